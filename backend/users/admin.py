@@ -13,7 +13,8 @@ from .models import (
     WeightProgress,
     WorkoutPlanRating,
     Season,
-    SavedWorkout
+    SavedWorkout,
+    RecommendedWorkout
 )
 
 @admin.register(CustomUser)
@@ -111,3 +112,9 @@ class SavedWorkoutAdmin(admin.ModelAdmin):
     list_display = ('client', 'workout_plan', 'saved_at')
     search_fields = ('client__user__username', 'workout_plan__id')
     list_filter = ('saved_at',)
+
+@admin.register(RecommendedWorkout)
+class RecommendedWorkoutAdmin(admin.ModelAdmin):
+    list_display = ('client', 'workout_plan', 'rank', 'computed_at')
+    search_fields = ('client__user__username', 'workout_plan__id')
+    raw_id_fields = ('client', 'workout_plan')
@@ -0,0 +1,176 @@
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from .models import PlanJob
+from .persistence import replace_meal_plan, create_workout_plan, day_number_from_key
+from .utils.meal_generator_new import generate_day_meals
+from .utils.workout_generator_new import generate_workout_plan
+
+#Plan generation jobs, queued by the generation endpoints and run by the run_plan_workers command
+#Handlers take the client, the job's params and a callback for reporting progress, and return the JSON result
+
+
+def run_meal_plan_job(client, params, report):
+    num_meals = params.get('num_meals', 3)
+
+    #Solves every meal of the day together so no food is repeated across meals
+    day_meals = generate_day_meals(client, num_meals)
+    report(80)
+
+    #An empty meal means the targets had no solution, the job fails and the current plan is kept
+    if not all(day_meals):
+        raise ValueError("No meal plan could meet the client's targets, their current plan was kept.")
+
+    #Replaces old meals with the new plan in one transaction
+    replace_meal_plan(client, day_meals)
+
+    meal_plans = [
+        {
+            'meal_number': meal_number,
+            'food_name': item['food_name'],
+            'weight_in_grams': item['weight_in_grams'],
+            'calories': item['calories'],
+            'protein': item['protein'],
+            'carbs': item['carbs'],
+            'fats': item['fats'],
+            'fiber': item.get('fiber', 0),
+            'servings': item.get('servings', 1)
+        }
+        for meal_number, meal_data in enumerate(day_meals, start=1)
+        for item in meal_data
+    ]
+    return {'meal_plans': meal_plans}
+
+
+def run_workout_plan_job(client, params, report):
+    generated_plan = generate_workout_plan(
+        params.get("workout_days", 3),
+        params.get("muscle_groups_per_day", []),
+        params.get("difficulty_level", "Intermediate"),
+        params.get("equipment_available", ["Dumbbell", "Barbell"]),
+        priority_muscles=params.get("priority_muscles", [])
+    )
+    report(80)
+
+    #Replaces the previous workout plan and saves every day in one transaction
+    new_plan = create_workout_plan(
+        client,
+        ((day_number_from_key(day), exercises) for day, exercises in generated_plan.items()),
+        replace_existing=True
+    )
+    return {
+        "message": "Workout plan generated and saved!",
+        "workout_plan": generated_plan,
+        "plan_id": new_plan.id
+    }
+
+
+JOB_HANDLERS = {
+    PlanJob.MEAL_PLAN: run_meal_plan_job,
+    PlanJob.WORKOUT_PLAN: run_workout_plan_job,
+}
+
+#Running jobs started longer ago than this are treated as abandoned by a worker that was stopped
+#Far longer than any solve takes, so a slow job is never failed while its worker is still on it
+STALE_JOB_TIMEOUT = timedelta(minutes=15)
+
+
+#Fails running jobs whose worker has stopped, so they no longer block new jobs for the client
+#Returns how many were failed
+def fail_stale_jobs():
+    return PlanJob.objects.filter(status=PlanJob.RUNNING, started_at__lt=now() - STALE_JOB_TIMEOUT).update(
+        status=PlanJob.FAILED, error="The worker stopped before the job finished.", finished_at=now()
+    )
+
+
+#Raised when a client already has an active job of the same kind with different params
+#Only one can be active per kind, so the request can't be queued until that job finishes
+class JobConflictError(Exception):
+    def __init__(self, job):
+        super().__init__("A plan with different settings is already being generated for this client.")
+        self.job = job
+
+
+def _existing_job(job, params):
+    if job.params != params:
+        raise JobConflictError(job)
+    return job, False
+
+
+#Queues a job, or returns the client's queued or running job of the same kind if it has the same params
+#Returns (job, created), raises JobConflictError if the active job's params differ
+def enqueue_job(client, kind, params):
+    fail_stale_jobs()
+    active = PlanJob.objects.filter(client=client, kind=kind, status__in=[PlanJob.QUEUED, PlanJob.RUNNING])
+    job = active.first()
+    if job is not None:
+        return _existing_job(job, params)
+
+    #A concurrent request can queue the same job first, the unique constraint then points at its job
+    try:
+        with transaction.atomic():
+            return PlanJob.objects.create(client=client, kind=kind, params=params), True
+    except IntegrityError:
+        return _existing_job(active.get(), params)
+
+
+#Marks the oldest queued job as running and returns it, or None if the queue is empty
+#The conditional update means two workers can never claim the same job
+def claim_next_job():
+    fail_stale_jobs()
+    while True:
+        job_id = (
+            PlanJob.objects.filter(status=PlanJob.QUEUED)
+            .order_by('id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        claimed = PlanJob.objects.filter(id=job_id, status=PlanJob.QUEUED).update(
+            status=PlanJob.RUNNING, started_at=now(), progress=10
+        )
+        if claimed:
+            return PlanJob.objects.select_related('client').get(id=job_id)
+
+
+#Runs a claimed job and stores its result, or its error if the handler raised
+def run_job(job):
+    def report(progress):
+        PlanJob.objects.filter(id=job.id).update(progress=progress)
+
+    try:
+        result = JOB_HANDLERS[job.kind](job.client, job.params, report)
+    except Exception as e:
+        PlanJob.objects.filter(id=job.id).update(status=PlanJob.FAILED, error=str(e), finished_at=now())
+    else:
+        PlanJob.objects.filter(id=job.id).update(
+            status=PlanJob.DONE, result=result, progress=100, finished_at=now()
+        )
+
+
+#Claims and runs queued jobs until the queue is empty, returns how many were run
+def run_pending_jobs():
+    count = 0
+    while (job := claim_next_job()) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+#Puts jobs left running by a stopped worker back in the queue, returns how many were requeued
+def requeue_running_jobs():
+    return PlanJob.objects.filter(status=PlanJob.RUNNING).update(status=PlanJob.QUEUED, started_at=None, progress=0)
+
+
+def serialize_job(job):
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,108 @@
+from bisect import bisect_left
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Case, When, Value, IntegerField
+from django.utils import timezone
+from .models import Leaderboard, Season
+
+#Season leaderboards kept as a ranked view in Django's cache
+#Points are added with F() expressions so concurrent awards are never lost, and every award bumps the
+#season's leaderboard_version in the same transaction. Cached views are keyed by that version, so a process
+#reading the season after an award never serves a view from before it, whichever cache it has
+
+#How long a cached view of one version is kept, old versions are never read again and just expire
+CACHE_TIMEOUT = 300
+
+
+def _cache_key(season):
+    return f"leaderboard:{season.id}:{season.leaderboard_version}"
+
+
+#A season's entries ordered by points, highest first, ties broken by the earliest entry
+#Ranks are competition style, clients with equal points share a rank
+class RankedLeaderboard:
+    def __init__(self, rows):
+        #rows are (entry_id, client_id, username, points)
+        self.order = sorted((-points, entry_id, client_id, username) for entry_id, client_id, username, points in rows)
+        self.keys = {client_id: (-points, entry_id) for entry_id, client_id, _, points in rows}
+
+    def __len__(self):
+        return len(self.order)
+
+    #Rank of a client, or None if they have no points this season
+    def rank_of(self, client_id):
+        key = self.keys.get(client_id)
+        if key is None:
+            return None
+        return bisect_left(self.order, (key[0],)) + 1
+
+    def points_of(self, client_id):
+        key = self.keys.get(client_id)
+        return -key[0] if key else 0
+
+    #The first limit entries (all of them if limit is None) with their ranks
+    def top(self, limit=None):
+        rows = []
+        rank = 0
+        previous = None
+        for i, (negative_points, _, client_id, username) in enumerate(self.order[:limit]):
+            if negative_points != previous:
+                rank, previous = i + 1, negative_points
+            rows.append({"rank": rank, "client_id": client_id, "client_username": username, "points": -negative_points})
+        return rows
+
+
+#The ranked view of a season, built with one query when the season's current version isn't cached
+def get_ranked_leaderboard(season):
+    board = cache.get(_cache_key(season))
+    if board is None:
+        rows = Leaderboard.objects.filter(trainer_id=season.trainer_id, season=season).values_list(
+            "id", "client_id", "client__user__username", "points"
+        )
+        board = RankedLeaderboard(list(rows))
+        cache.set(_cache_key(season), board, CACHE_TIMEOUT)
+    return board
+
+
+#Moves a season to a new leaderboard version, so views cached before the award are no longer read
+#Called inside the award's transaction, season is left holding the new version
+def _bump_version(season):
+    Season.objects.filter(pk=season.pk).update(leaderboard_version=F("leaderboard_version") + 1)
+    season.refresh_from_db(fields=["leaderboard_version"])
+
+
+#Adds points to a client's entry for the season atomically and returns their new total
+#update() skips save(), so updated_at is set here rather than by auto_now
+def award_points(trainer, season, client, points):
+    with transaction.atomic():
+        entry, _ = Leaderboard.objects.get_or_create(
+            client=client, trainer=trainer, season=season,
+            defaults={"points": 0}
+        )
+        Leaderboard.objects.filter(pk=entry.pk).update(points=F("points") + points, updated_at=timezone.now())
+        total = Leaderboard.objects.values_list("points", flat=True).get(pk=entry.pk)
+        _bump_version(season)
+    return total
+
+
+#Adds points to many clients' entries for the season in one transaction, awards maps client ids to points
+#Missing entries are created with one insert and every increment is applied with one UPDATE, which also sets updated_at
+#Returns the new totals as {client_id: points}
+def award_points_bulk(trainer, season, awards):
+    if not awards:
+        return {}
+
+    with transaction.atomic():
+        Leaderboard.objects.bulk_create(
+            [Leaderboard(client_id=client_id, trainer=trainer, season=season, points=0) for client_id in awards],
+            ignore_conflicts=True
+        )
+        entries = Leaderboard.objects.filter(trainer=trainer, season=season, client_id__in=awards)
+        entries.update(points=F("points") + Case(
+            *[When(client_id=client_id, then=Value(points)) for client_id, points in awards.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ), updated_at=timezone.now())
+        totals = dict(entries.values_list("client_id", "points"))
+        _bump_version(season)
+    return totals
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from users.utils.weight_rollups import backfill_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the weekly weight rollups of every client from their weight entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Entries read and rollups written at a time")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        entries, rollups = backfill_rollups(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {rollups} weekly rollups from {entries} weight entries in {elapsed:.2f}s."
+        ))
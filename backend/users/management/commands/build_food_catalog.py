@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from users.utils.food_catalog import build_records, source_hash, snapshot_path, write_snapshot, FoodCatalog
+
+
+class Command(BaseCommand):
+    help = "Merge the food CSVs and write the food catalog snapshot the meal solver loads at startup"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        version = source_hash()
+        catalog = FoodCatalog(build_records(), version)
+        path = snapshot_path(version)
+        write_snapshot(catalog.records, path)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(catalog)} foods ({int(catalog.fiber_estimated.sum())} with estimated fiber), "
+            f"version {catalog.version}, to {path} in {elapsed:.2f}s."
+        ))
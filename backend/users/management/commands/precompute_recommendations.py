@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from users.utils.knn_recommender import precompute_recommendations
+
+
+class Command(BaseCommand):
+    help = "Precompute KNN workout recommendations for every client"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=5, help="Number of similar clients to draw plans from")
+        parser.add_argument('--limit', type=int, default=5, help="Maximum recommendations stored per client")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        clients, recommendations = precompute_recommendations(k=options['k'], limit=options['limit'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {recommendations} recommendations for {clients} clients in {elapsed:.2f}s."
+        ))
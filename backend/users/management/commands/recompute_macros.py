@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from users.utils.macros import recompute_macros
+
+
+class Command(BaseCommand):
+    help = "Recompute daily calorie and macro targets for every client in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Profiles loaded and recomputed at a time")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Profiles written per UPDATE statement")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        processed = updated = 0
+
+        for chunk_processed, chunk_updated in recompute_macros(
+            chunk_size=options['chunk_size'], batch_size=options['batch_size']
+        ):
+            processed += chunk_processed
+            updated += chunk_updated
+            if options['verbosity'] > 1:
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{processed} profiles processed ({processed / elapsed:.0f}/s)")
+
+        elapsed = time.perf_counter() - start
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed macros for {processed} clients, {updated} updated, in {elapsed:.2f}s ({rate:.0f} profiles/s)."
+        ))
@@ -0,0 +1,72 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from users.models import ClientProfile
+from users.persistence import replace_meal_plans
+from users.utils.meal_generator_new import meal_targets, solve_day_meals_task
+
+
+class Command(BaseCommand):
+    help = "Regenerate meal plans for a trainer's clients or every client, solving in a process pool"
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--trainer', help="Username of the trainer whose clients are regenerated")
+        group.add_argument('--all', action='store_true', help="Regenerate every client's meal plan")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of solver processes")
+        parser.add_argument('--num-meals', type=int, default=3, help="Meals per day")
+        parser.add_argument('--batch-size', type=int, default=200, help="Clients written per transaction")
+
+    def handle(self, *args, **options):
+        clients = ClientProfile.objects.only(
+            'id', 'daily_calories', 'daily_protein', 'daily_carbs', 'daily_fat', 'daily_fiber', 'dietary_preference'
+        ).order_by('id')
+        if options['trainer']:
+            clients = clients.filter(trainer__username=options['trainer'])
+            if not ClientProfile.objects.filter(trainer__username=options['trainer']).exists():
+                raise CommandError(f"No clients found for trainer '{options['trainer']}'.")
+
+        num_meals = options['num_meals']
+        start = time.perf_counter()
+        solved = failed = 0
+        pending = {}
+
+        #Workers are sent plain targets, each one loads the food table once when it first imports the solver
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = []
+            for client in clients.iterator():
+                if client.daily_calories is None:
+                    failed += 1
+                    continue
+                futures.append(executor.submit(
+                    solve_day_meals_task, client.id, meal_targets(client, num_meals), num_meals, client.dietary_preference
+                ))
+
+            for future in as_completed(futures):
+                try:
+                    client_id, day_meals = future.result()
+                except Exception as e:
+                    self.stderr.write(f"Solve failed: {e}")
+                    failed += 1
+                    continue
+
+                #A day with an empty meal had no feasible solution, the client's current plan is kept
+                if not all(day_meals):
+                    failed += 1
+                    continue
+
+                pending[client_id] = day_meals
+                solved += 1
+                if len(pending) >= options['batch_size']:
+                    replace_meal_plans(pending)
+                    pending = {}
+
+        if pending:
+            replace_meal_plans(pending)
+
+        elapsed = time.perf_counter() - start
+        rate = solved / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Regenerated {solved} meal plans, {failed} failed, in {elapsed:.2f}s ({rate:.1f} plans/s)."
+        ))
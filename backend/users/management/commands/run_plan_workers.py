@@ -0,0 +1,59 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from users.jobs import claim_next_job, run_job, requeue_running_jobs
+
+
+class Command(BaseCommand):
+    help = "Run a pool of workers that generate queued meal and workout plans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Number of worker threads")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty instead of waiting for jobs")
+        parser.add_argument(
+            '--requeue-running', action='store_true',
+            help="Requeue jobs left running by a worker that stopped, only safe when no other workers are running"
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue_running']:
+            requeued = requeue_running_jobs()
+            self.stdout.write(f"Requeued {requeued} running jobs.")
+
+        stop = threading.Event()
+        completed = []
+
+        #Each thread claims jobs until stopped, or until the queue is empty with --once
+        def work():
+            try:
+                while not stop.is_set():
+                    job = claim_next_job()
+                    if job is None:
+                        if options['once']:
+                            return
+                        stop.wait(options['poll_interval'])
+                        continue
+                    start = time.perf_counter()
+                    run_job(job)
+                    completed.append(job.id)
+                    self.stdout.write(f"Finished {job.kind} job {job.id} in {time.perf_counter() - start:.2f}s")
+            finally:
+                #Every thread has its own database connection
+                connection.close()
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(self.style.SUCCESS(f"Workers stopped after running {len(completed)} jobs."))
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendedWorkout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(help_text="Position in the client's recommendations, 1 is best")),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_workouts', to='users.clientprofile')),
+                ('workout_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_to', to='users.workoutplan')),
+            ],
+            options={
+                'ordering': ['client', 'rank'],
+                'unique_together': {('client', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_recommendedworkout'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='weightprogress',
+            index=models.Index(fields=['client', 'date'], name='weightprogress_client_date'),
+        ),
+    ]
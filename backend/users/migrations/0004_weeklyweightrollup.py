@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_weightprogress_client_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyWeightRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('iso_year', models.PositiveSmallIntegerField()),
+                ('iso_week', models.PositiveSmallIntegerField()),
+                ('min_weight', models.FloatField()),
+                ('max_weight', models.FloatField()),
+                ('mean_weight', models.FloatField()),
+                ('last_weight', models.FloatField(help_text='Weight of the latest entry in the week')),
+                ('last_date', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_weights', to='users.clientprofile')),
+            ],
+            options={
+                'ordering': ['client', 'iso_year', 'iso_week'],
+                'unique_together': {('client', 'iso_year', 'iso_week')},
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:45
+
+import django.db.models.functions.text
+from django.db import migrations, models, OperationalError
+
+#SQLite FTS5 index over trainer usernames and bios, kept in sync by triggers
+#Skipped on other databases or SQLite builds without FTS5, trainer search then falls back to LIKE
+FTS_SQL = [
+    "CREATE VIRTUAL TABLE users_trainersearch USING fts5(username, bio)",
+    """CREATE TRIGGER users_trainersearch_insert AFTER INSERT ON users_trainerprofile BEGIN
+        INSERT INTO users_trainersearch(rowid, username, bio)
+        SELECT new.id, u.username, coalesce(new.bio, '') FROM users_customuser u WHERE u.id = new.user_id;
+    END""",
+    """CREATE TRIGGER users_trainersearch_update AFTER UPDATE ON users_trainerprofile BEGIN
+        DELETE FROM users_trainersearch WHERE rowid = old.id;
+        INSERT INTO users_trainersearch(rowid, username, bio)
+        SELECT new.id, u.username, coalesce(new.bio, '') FROM users_customuser u WHERE u.id = new.user_id;
+    END""",
+    """CREATE TRIGGER users_trainersearch_delete AFTER DELETE ON users_trainerprofile BEGIN
+        DELETE FROM users_trainersearch WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER users_trainersearch_username AFTER UPDATE OF username ON users_customuser BEGIN
+        UPDATE users_trainersearch SET username = new.username
+        WHERE rowid IN (SELECT id FROM users_trainerprofile WHERE user_id = new.id);
+    END""",
+    """INSERT INTO users_trainersearch(rowid, username, bio)
+        SELECT t.id, u.username, coalesce(t.bio, '') FROM users_trainerprofile t
+        JOIN users_customuser u ON u.id = t.user_id""",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS users_trainersearch_insert",
+    "DROP TRIGGER IF EXISTS users_trainersearch_update",
+    "DROP TRIGGER IF EXISTS users_trainersearch_delete",
+    "DROP TRIGGER IF EXISTS users_trainersearch_username",
+    "DROP TABLE IF EXISTS users_trainersearch",
+]
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_check USING fts5(text)")
+            cursor.execute("DROP TABLE temp.fts5_check")
+    except OperationalError:
+        return
+    for statement in FTS_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_weeklyweightrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='customuser_username_lower'),
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_trainer_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('meal_plan', 'Meal Plan'), ('workout_plan', 'Workout Plan')], max_length=20)),
+                ('params', models.JSONField(blank=True, default=dict, help_text='Request data passed to the generator')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('progress', models.PositiveSmallIntegerField(default=0, help_text='Percentage complete')),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plan_jobs', to='users.clientprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='planjob_status_id')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('client', 'kind'), name='one_active_plan_job_per_kind')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_planjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='season',
+            name='leaderboard_version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented by every points award, keys cached leaderboards'),
+        ),
+    ]
@@ -1,9 +1,11 @@
 from django.db import models
+import copy
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from datetime import date
 from django.core.exceptions import ValidationError
 from django.utils.timezone import now
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Lower
 # Create your models here.
 
 #Custom User model for authentication
@@ -11,6 +13,10 @@ class CustomUser(AbstractUser):
     is_trainer = models.BooleanField(default=False)
     is_client = models.BooleanField(default=False)
 
+    class Meta(AbstractUser.Meta):
+        #Trainer search matches username prefixes case insensitively through this index
+        indexes = [models.Index(Lower('username'), name='customuser_username_lower')]
+
     def __str__(self):
         return self.username
 
@@ -23,6 +29,29 @@ class TrainerProfile(models.Model):
     def __str__(self):
         return self.user.username
 
+#ClientProfile fields that calculate_macronutrients depends on
+MACRO_INPUT_FIELDS = {"weight", "height", "date_of_birth", "gender", "activity_level", "goal", "protein_multiplier"}
+
+#ClientProfile fields written by calculate_macronutrients
+MACRO_FIELDS = {"daily_calories", "daily_carbs", "daily_protein", "daily_fat", "daily_fiber", "macronutrient_last_updated"}
+
+#Multipliers applied to BMR to get maintenance calories for each activity level
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.2,
+    'lightly_active': 1.375,
+    'moderately_active': 1.55,
+    'very_active': 1.725,
+    'super_active': 1.9,
+}
+DEFAULT_ACTIVITY_MULTIPLIER = 1.55
+
+#Calories added to maintenance for each goal, 500 deficit for weight loss and 500 surplus for muscle gain
+#Maintaining weight has no adjustment
+GOAL_CALORIE_ADJUSTMENTS = {
+    'lose_weight': -500,
+    'gain_muscle': 500,
+}
+
 #Client profile
 class ClientProfile(models.Model):
     WEIGHT_GOALS = [
@@ -118,29 +147,14 @@ class ClientProfile(models.Model):
         else:
             bmr = 10 * self.weight + 6.25 * self.height - 5 * self.age - 161
 
-        #Activity multipliers based on activity level
-        activity_multipliers = {
-            'sedentary': 1.2,
-            'lightly_active': 1.375,
-            'moderately_active': 1.55,
-            'very_active': 1.725,
-            'super_active': 1.9,
-        }
-        activity_multiplier = activity_multipliers.get(self.activity_level, 1.55)
+        #Activity multiplier based on activity level
+        activity_multiplier = ACTIVITY_MULTIPLIERS.get(self.activity_level, DEFAULT_ACTIVITY_MULTIPLIER)
 
         #Calculates maintenance calories based on activity multiplier
         maintenance_calories = bmr * activity_multiplier
 
         #Adjust calories based on goal
-        if self.goal == "lose_weight":
-            #500 calorie deficit for weight loss
-            daily_calories = maintenance_calories - 500  
-        elif self.goal == "gain_muscle":
-            #500 calorie surplus for muscle/weight gain
-            daily_calories = maintenance_calories + 500  
-        else:
-            #No adjustment for maintaining weight
-            daily_calories = maintenance_calories  
+        daily_calories = maintenance_calories + GOAL_CALORIE_ADJUSTMENTS.get(self.goal, 0)
 
         #Daily macronutrient targets
         #Uses custom protein multiplier
@@ -164,18 +178,66 @@ class ClientProfile(models.Model):
             "daily_fiber": round(daily_fiber, 2),
         }
     
+    #Values of the concrete fields as last loaded from or saved to the database
+    #Deferred fields are left out so taking the snapshot never triggers a query
+    def _snapshot_fields(self, fields=None):
+        if fields is None:
+            self._saved_values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.attname in fields):
+                self._saved_values[field.attname] = copy.deepcopy(self.__dict__[field.attname])
+
+    #Names of fields changed since the profile was loaded or last saved
+    def changed_fields(self):
+        return {
+            name for name, value in self._saved_values.items()
+            if self.__dict__.get(name, value) != value
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._snapshot_fields()
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot_fields(fields)
+
     def save(self, *args, **kwargs):
-        #Macros are updated before model is saved to ensure up to date targets
-        macros = self.calculate_macronutrients()
-        self.daily_calories = macros["daily_calories"]
-        self.daily_carbs = macros["daily_carbs"]
-        self.daily_protein = macros["daily_protein"]
-        self.daily_fat = macros["daily_fat"]
-        self.daily_fiber = macros["daily_fiber"]
-        self.macronutrient_last_updated = now()
+        changed = self.changed_fields()
+        update_fields = kwargs.get("update_fields")
+        adding = self._state.adding
+
+        #A partial save only writes the listed fields, other changes stay pending for a later save
+        if update_fields is not None:
+            changed &= {self._meta.get_field(name).attname for name in update_fields}
+
+        #Macros are only recalculated when a field they depend on changes, or they have never been set
+        if adding or self.daily_calories is None or changed & MACRO_INPUT_FIELDS:
+            macros = self.calculate_macronutrients()
+            self.daily_calories = macros["daily_calories"]
+            self.daily_carbs = macros["daily_carbs"]
+            self.daily_protein = macros["daily_protein"]
+            self.daily_fat = macros["daily_fat"]
+            self.daily_fiber = macros["daily_fiber"]
+            self.macronutrient_last_updated = now()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | MACRO_FIELDS
+            changed |= MACRO_FIELDS
+
+        #Saves of an existing profile only write the columns that changed
+        if not adding and update_fields is None and not args and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = {
+                field.name for field in self._meta.concrete_fields if field.attname in changed
+            }
 
         #Calls original save method
-        super().save(*args, **kwargs)  
+        super().save(*args, **kwargs)
+
+        #Only fields that were written count as saved
+        if kwargs.get("update_fields") is None:
+            self._snapshot_fields()
+        else:
+            self._snapshot_fields({self._meta.get_field(name).attname for name in kwargs["update_fields"]})
 
 class WorkoutPlan(models.Model):
     client = models.ForeignKey("ClientProfile", on_delete=models.CASCADE, related_name="workout_plans")
@@ -279,6 +341,7 @@ class Season(models.Model):
     second_place_reward = models.CharField(max_length=255)
     third_place_reward = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
+    leaderboard_version = models.PositiveIntegerField(default=0, help_text="Incremented by every points award, keys cached leaderboards")
 
     def __str__(self):
         return f"{self.name} ({self.trainer.user.username})"
@@ -290,6 +353,10 @@ class WeightProgress(models.Model):
     date = models.DateField(default=now, help_text="Date of recorded weight")
     weight = models.FloatField(help_text="Weight in kg")
 
+    class Meta:
+        #Weight history is always read per client in date order
+        indexes = [models.Index(fields=['client', 'date'], name='weightprogress_client_date')]
+
     def __str__(self):
         return f"{self.client.user.username} - {self.weight} kg on {self.date}"
     
@@ -312,3 +379,83 @@ class SavedWorkout(models.Model):
 
     def __str__(self):
         return f"{self.client.user.username} saved Plan {self.workout_plan.id}"
+
+#Recommendations precomputed in bulk by the precompute_recommendations command
+class RecommendedWorkout(models.Model):
+    client = models.ForeignKey(ClientProfile, on_delete=models.CASCADE, related_name="recommended_workouts")
+    workout_plan = models.ForeignKey(WorkoutPlan, on_delete=models.CASCADE, related_name="recommended_to")
+    rank = models.PositiveIntegerField(help_text="Position in the client's recommendations, 1 is best")
+    computed_at = models.DateTimeField(default=now)
+
+    class Meta:
+        unique_together = ('client', 'rank')
+        ordering = ['client', 'rank']
+
+    def __str__(self):
+        return f"Plan {self.workout_plan_id} recommended to {self.client.user.username} (#{self.rank})"
+
+#Weekly summary of a client's weight entries, keyed by ISO week
+#Maintained on write by users/utils/weight_rollups.py so trend views read one row per client per week
+class WeeklyWeightRollup(models.Model):
+    client = models.ForeignKey(ClientProfile, on_delete=models.CASCADE, related_name='weekly_weights')
+    iso_year = models.PositiveSmallIntegerField()
+    iso_week = models.PositiveSmallIntegerField()
+    min_weight = models.FloatField()
+    max_weight = models.FloatField()
+    mean_weight = models.FloatField()
+    last_weight = models.FloatField(help_text="Weight of the latest entry in the week")
+    last_date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('client', 'iso_year', 'iso_week')
+        ordering = ['client', 'iso_year', 'iso_week']
+
+    def __str__(self):
+        return f"{self.client.user.username} - {self.iso_year} week {self.iso_week}: {self.mean_weight:.1f} kg"
+
+#Meal and workout plan generation queued for the run_plan_workers command
+#A client can only have one queued or running job of each kind, repeat requests are given the existing job
+class PlanJob(models.Model):
+    MEAL_PLAN = 'meal_plan'
+    WORKOUT_PLAN = 'workout_plan'
+    KINDS = [
+        (MEAL_PLAN, 'Meal Plan'),
+        (WORKOUT_PLAN, 'Workout Plan'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    client = models.ForeignKey(ClientProfile, on_delete=models.CASCADE, related_name='plan_jobs')
+    kind = models.CharField(max_length=20, choices=KINDS)
+    params = models.JSONField(default=dict, blank=True, help_text="Request data passed to the generator")
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percentage complete")
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['client', 'kind'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_plan_job_per_kind'
+            )
+        ]
+        #Workers claim the oldest queued job
+        indexes = [models.Index(fields=['status', 'id'], name='planjob_status_id')]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job {self.id} for {self.client.user.username} ({self.status})"
@@ -0,0 +1,91 @@
+from django.db import transaction
+from .models import MealPlan, WorkoutPlan, WorkoutPlanDay
+
+#Write helpers for generated meal and workout plans
+#Each plan is deleted and re-inserted with bulk_create inside one transaction
+#so a save commits once and readers never see a half written plan
+
+
+#Unsaved MealPlan rows for one meal's food dictionaries
+def _meal_rows(client_id, meal_number, items):
+    return [
+        MealPlan(
+            client_id=client_id,
+            meal_number=meal_number,
+            food_name=item['food_name'],
+            weight_in_grams=item['weight_in_grams'],
+            calories=item['calories'],
+            protein=item['protein'],
+            carbs=item['carbs'],
+            fats=item['fats'],
+            fiber=item.get('fiber', 0),
+            servings=item.get('servings', 1),
+        )
+        for item in items
+    ]
+
+
+#Replaces all of a client's meals, day_meals is a list of food lists starting at meal 1
+def replace_meal_plan(client, day_meals):
+    rows = [
+        row
+        for meal_number, items in enumerate(day_meals, start=1)
+        for row in _meal_rows(client.id, meal_number, items)
+    ]
+    with transaction.atomic():
+        MealPlan.objects.filter(client=client).delete()
+        MealPlan.objects.bulk_create(rows)
+
+
+#Replaces the meals of many clients at once, plans maps client ids to lists of food lists starting at meal 1
+def replace_meal_plans(plans):
+    rows = [
+        row
+        for client_id, day_meals in plans.items()
+        for meal_number, items in enumerate(day_meals, start=1)
+        for row in _meal_rows(client_id, meal_number, items)
+    ]
+    with transaction.atomic():
+        MealPlan.objects.filter(client_id__in=plans).delete()
+        MealPlan.objects.bulk_create(rows)
+
+
+#Replaces the foods of a single meal, leaving the client's other meals untouched
+def replace_meal(client, meal_number, items):
+    with transaction.atomic():
+        MealPlan.objects.filter(client=client, meal_number=meal_number).delete()
+        MealPlan.objects.bulk_create(_meal_rows(client.id, meal_number, items))
+
+
+#Day number from a "Day N" key as used in generated and edited plans
+def day_number_from_key(key):
+    return int(str(key).replace("Day ", ""))
+
+
+#Replaces the days of an existing plan, days is an iterable of (day_number, exercises)
+def replace_workout_days(workout_plan, days):
+    rows = [
+        WorkoutPlanDay(workout_plan=workout_plan, day_number=day_number, exercises=exercises)
+        for day_number, exercises in days
+    ]
+    with transaction.atomic():
+        WorkoutPlanDay.objects.filter(workout_plan=workout_plan).delete()
+        WorkoutPlanDay.objects.bulk_create(rows)
+
+
+#Creates a plan and all of its days in one transaction
+#training_frequency defaults to the number of days, replace_existing deletes the client's previous plans first
+def create_workout_plan(client, days, training_frequency=None, replace_existing=False):
+    days = list(days)
+    with transaction.atomic():
+        if replace_existing:
+            WorkoutPlan.objects.filter(client=client).delete()
+        workout_plan = WorkoutPlan.objects.create(
+            client=client,
+            training_frequency=training_frequency if training_frequency is not None else len(days)
+        )
+        WorkoutPlanDay.objects.bulk_create([
+            WorkoutPlanDay(workout_plan=workout_plan, day_number=day_number, exercises=exercises)
+            for day_number, exercises in days
+        ])
+    return workout_plan
@@ -0,0 +1,127 @@
+import base64
+import json
+from django.db.models import Q
+from .models import ClientProfile
+
+#Cursor paginated listing of a trainer's clients
+#Pages are read with keyset pagination on (sort field, id), so each page is one query however deep it is
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+#Fields each client can be serialised with, fields= picks a subset
+ROSTER_FIELDS = {
+    'id': lambda client: client.id,
+    'username': lambda client: client.user.username,
+    'first_name': lambda client: client.user.first_name,
+    'last_name': lambda client: client.user.last_name,
+    'email': lambda client: client.user.email,
+    'date_of_birth': lambda client: client.date_of_birth.strftime('%Y-%m-%d'),
+    'gender': lambda client: client.gender,
+    'height': lambda client: client.height,
+    'weight': lambda client: client.weight,
+    'goal': lambda client: client.goal,
+    'goal_label': lambda client: client.get_goal_display(),
+    'activity_level': lambda client: client.activity_level,
+    'priority_muscles': lambda client: client.priority_muscles,
+    'profile_picture': lambda client: client.profile_picture.url if client.profile_picture else None,
+    'protein_multiplier': lambda client: client.protein_multiplier if client.protein_multiplier else 1.8,
+    'daily_calories': lambda client: client.daily_calories if client.daily_calories else 0,
+    'daily_carbs': lambda client: client.daily_carbs if client.daily_carbs else 0,
+    'daily_protein': lambda client: client.daily_protein if client.daily_protein else 0,
+    'daily_fat': lambda client: client.daily_fat if client.daily_fat else 0,
+    'daily_fiber': lambda client: client.daily_fiber if client.daily_fiber else 0,
+}
+
+#Values of sort= and the column each one orders by, prefix with - for descending
+SORT_FIELDS = {
+    'id': 'id',
+    'username': 'user__username',
+    'first_name': 'user__first_name',
+    'last_name': 'user__last_name',
+    'date_of_birth': 'date_of_birth',
+    'height': 'height',
+    'weight': 'weight',
+}
+
+
+#Raised for invalid roster query parameters, the message is returned to the client
+class RosterQueryError(ValueError):
+    pass
+
+
+def _encode_cursor(value, client_id):
+    return base64.urlsafe_b64encode(json.dumps([value, client_id], default=str).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        value, client_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(client_id)
+    except (ValueError, TypeError):
+        raise RosterQueryError("Invalid cursor.")
+
+
+#Value of a sort column on a client, following user__ to the related user
+def _column_value(client, column):
+    obj = client
+    for part in column.split('__'):
+        obj = getattr(obj, part)
+    return obj
+
+
+#Parses the roster query parameters into a dict of options for roster_page
+def parse_roster_params(params):
+    fields = [field for field in params.get('fields', '').split(',') if field] or list(ROSTER_FIELDS)
+    unknown = [field for field in fields if field not in ROSTER_FIELDS]
+    if unknown:
+        raise RosterQueryError(f"Unknown fields: {', '.join(unknown)}")
+
+    sort = params.get('sort', 'id')
+    if sort.lstrip('-') not in SORT_FIELDS:
+        raise RosterQueryError(f"Cannot sort by {sort.lstrip('-')}.")
+
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise RosterQueryError("Limit must be a whole number.")
+
+    return {
+        'fields': fields,
+        'sort': sort,
+        'limit': min(max(limit, 1), MAX_PAGE_SIZE),
+        'cursor': params.get('cursor') or None,
+        'goals': [goal for goal in params.get('goal', '').split(',') if goal],
+        'activity_levels': [level for level in params.get('activity_level', '').split(',') if level],
+    }
+
+
+#One page of a trainer's clients, returns the serialised clients and the cursor for the next page (None on the last page)
+def roster_page(trainer, fields, sort='id', limit=DEFAULT_PAGE_SIZE, cursor=None, goals=(), activity_levels=()):
+    descending = sort.startswith('-')
+    column = SORT_FIELDS[sort.lstrip('-')]
+
+    clients = ClientProfile.objects.filter(trainer=trainer).select_related('user')
+    if goals:
+        clients = clients.filter(goal__in=goals)
+    if activity_levels:
+        clients = clients.filter(activity_level__in=activity_levels)
+
+    #Continues after the last client of the previous page, ties on the sort column are broken by id
+    if cursor:
+        value, last_id = _decode_cursor(cursor)
+        after = 'lt' if descending else 'gt'
+        clients = clients.filter(
+            Q(**{f'{column}__{after}': value}) | Q(**{column: value, f'id__{after}': last_id})
+        )
+
+    prefix = '-' if descending else ''
+    page = list(clients.order_by(f'{prefix}{column}', f'{prefix}id')[:limit + 1])
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = _encode_cursor(_column_value(last, column), last.id)
+
+    return [{field: ROSTER_FIELDS[field](client) for field in fields} for client in page], next_cursor
@@ -0,0 +1,50 @@
+from django.db.models import OuterRef, Subquery, Prefetch
+from .models import WorkoutPlan, WorkoutPlanDay, WorkoutPlanRating
+
+#Helpers that turn WorkoutPlan querysets into JSON friendly dictionaries
+#Related data is resolved in bulk so the number of queries doesn't grow with the number of plans
+
+
+#Annotates plans with their top rating's name and rater, plus the given client's own rating
+def with_rating_summary(plans, client=None):
+    top_rating = WorkoutPlanRating.objects.filter(workout_plan=OuterRef("pk")).order_by("-rating", "id")
+    plans = plans.annotate(
+        top_workout_name=Subquery(top_rating.values("workout_name")[:1]),
+        top_rated_by=Subquery(top_rating.values("client__user__username")[:1]),
+    )
+    if client is not None:
+        own_rating = WorkoutPlanRating.objects.filter(workout_plan=OuterRef("pk"), client=client)
+        plans = plans.annotate(client_rating=Subquery(own_rating.values("rating")[:1]))
+    return plans
+
+
+#Serialises a plan annotated by with_rating_summary
+def serialize_plan_summary(plan):
+    data = {
+        "plan_id": plan.id,
+        "training_frequency": plan.training_frequency,
+        "created_at": plan.created_at.strftime('%Y-%m-%d'),
+        "workout_name": plan.top_workout_name if plan.top_workout_name is not None else "Unnamed Plan",
+        "rated_by": plan.top_rated_by if plan.top_rated_by is not None else "Unknown"
+    }
+    if hasattr(plan, "client_rating"):
+        data["client_rating"] = plan.client_rating
+    return data
+
+
+#Plans a client has shortlisted, in the order they were saved
+#Ratings are annotated and days prefetched, so listing any number of plans takes two queries
+def saved_plans_for(client):
+    plans = WorkoutPlan.objects.filter(savedworkout__client=client).order_by("savedworkout__id")
+    return with_rating_summary(plans).prefetch_related(
+        Prefetch("days", queryset=WorkoutPlanDay.objects.order_by("day_number"))
+    )
+
+
+#Serialises a plan from saved_plans_for, including its exercises for each day
+def serialize_plan_with_days(plan):
+    data = serialize_plan_summary(plan)
+    data["workout_plan"] = {
+        f"Day {day.day_number}": day.exercises for day in plan.days.all()
+    }
+    return data
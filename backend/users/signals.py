@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import ClientProfile, WorkoutPlanRating
+from .utils.knn_recommender import recommender_index
+
+#Keeps the in-memory KNN index in sync with profile and rating writes
+#Updates run on commit so rolled back writes never reach the index
+
+@receiver(post_save, sender=ClientProfile)
+def update_recommender_client(sender, instance, **kwargs):
+    transaction.on_commit(lambda: recommender_index.update_client(instance))
+
+@receiver(post_save, sender=WorkoutPlanRating)
+@receiver(post_delete, sender=WorkoutPlanRating)
+def update_recommender_ratings(sender, instance, **kwargs):
+    client_id = instance.client_id
+    transaction.on_commit(lambda: recommender_index.update_client_ratings(client_id))
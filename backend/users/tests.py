@@ -2,9 +2,20 @@ from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from .models import ClientProfile, MealPlan, WorkoutPlan, WorkoutPlanDay, TrainerProfile, Season, Leaderboard, WeightProgress, WorkoutPlanRating
-from .models import WorkoutPlan, WorkoutPlanRating
-from datetime import date
+from .models import WorkoutPlan, WorkoutPlanRating, RecommendedWorkout, SavedWorkout, WeeklyWeightRollup, PlanJob
+from .utils.knn_recommender import recommender_index, get_top_recommended_workouts_for_client, ClientFeatureEncoder
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .persistence import replace_meal_plan, replace_meal_plans, create_workout_plan
+from .jobs import run_pending_jobs
+from datetime import date, timedelta
+from io import StringIO
+import numpy as np
 import json
+import os
+import tempfile
 
 User = get_user_model()
 
@@ -122,12 +133,17 @@ class MealPlanGenerationTests(TestCase):
             content_type='application/json'
         )
 
-        #Checks 200 ok response code 
-        self.assertEqual(response.status_code, 200)
+        #Checks the generation was queued, then runs it as a worker would
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        self.assertEqual(run_pending_jobs(), 1)
+        response = self.client.get(f'/plan-jobs/{job_id}/')
+        self.assertEqual(response.json()['status'], 'done')
 
         #Checks that returned JSON has correct structure
-        self.assertIn('meal_plans', response.json())
-        self.assertGreater(len(response.json()['meal_plans']), 0)
+        result = response.json()['result']
+        self.assertIn('meal_plans', result)
+        self.assertGreater(len(result['meal_plans']), 0)
 
         #Filters existing meal plans to only include ones assigned to test client
         meals = MealPlan.objects.filter(client=self.client_profile)
@@ -168,6 +184,168 @@ class MealPlanGenerationTests(TestCase):
         assert_within_tolerance(total_fats, target_fats)
         assert_within_tolerance(total_fiber, target_fiber)
 
+    def test_meal_plan_job_without_a_solution_keeps_the_current_plan(self):
+        MealPlan.objects.create(
+            client=self.client_profile, meal_number=1, food_name='Rice', weight_in_grams=100,
+            calories=130, protein=3, carbs=28, fats=0
+        )
+
+        #No food mix has this much protein in so few calories
+        ClientProfile.objects.filter(id=self.client_profile.id).update(daily_calories=300, daily_protein=500)
+        response = self.client.post(
+            f'/generate-meal-plan/{self.client_profile.id}/', data={'num_meals': 3}, content_type='application/json'
+        )
+        run_pending_jobs()
+
+        job = self.client.get(f"/plan-jobs/{response.json()['job_id']}/").json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertTrue(job['error'])
+        self.assertEqual(list(MealPlan.objects.filter(client=self.client_profile).values_list('food_name', flat=True)), ['Rice'])
+
+    def test_solver_excludes_previous_foods(self):
+        from .utils.meal_generator_new import meal_solver, meal_targets
+
+        #Excluded foods are bounded at zero servings without rebuilding the matrix
+        excluded = set(meal_solver.food_names[:10])
+        servings = meal_solver.solve(meal_targets(self.client_profile), excluded=excluded)
+        self.assertIsNotNone(servings)
+        used = {item['food_name'] for item in meal_solver.meal_items(servings)}
+        self.assertTrue(used)
+        self.assertFalse(used & excluded)
+
+    def test_day_meals_do_not_share_foods(self):
+        from .utils.meal_generator_new import generate_day_meals
+
+        #All meals come from one joint solve, so each food appears in at most one meal
+        day = generate_day_meals(self.client_profile, num_meals=3)
+        self.assertEqual(len(day), 3)
+        names = [item['food_name'] for meal in day for item in meal]
+        self.assertTrue(all(day))
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_dietary_preference_limits_foods(self):
+        from .utils.food_catalog import dietary_tags
+        from .utils.meal_generator_new import generate_day_meals, meal_solvers
+
+        self.assertEqual(dietary_tags("chicken sausage"), {"meat"})
+        self.assertEqual(dietary_tags("chick peas"), {"legume"})
+        self.assertEqual(dietary_tags("peanut butter"), {"legume"})
+        self.assertEqual(dietary_tags("Cottage cheese"), {"dairy"})
+
+        #Restricted preferences get a smaller table, and plans only use foods from it
+        vegan = meal_solvers["vegan"]
+        self.assertLess(len(vegan), len(meal_solvers["any"]))
+        self.assertNotIn("salmon", vegan.food_names)
+        self.assertNotIn("eggs", vegan.food_names)
+        self.assertNotIn("white rice", meal_solvers["ketogenic"].food_names)
+
+        self.client_profile.dietary_preference = 'vegetarian'
+        day = generate_day_meals(self.client_profile, num_meals=3)
+        eligible = set(meal_solvers["vegetarian"].food_names)
+        self.assertTrue(all(item['food_name'] in eligible for meal in day for item in meal))
+
+    def test_ketogenic_client_gets_a_full_day_within_their_carb_limit(self):
+        from .utils.meal_generator_new import carb_limit, generate_day_meals, meal_solvers, meal_targets
+
+        #The standard carb split can't be met by keto foods, so the carbs over the limit move to fat
+        self.client_profile.dietary_preference = 'ketogenic'
+        targets = meal_targets(self.client_profile)
+        limit = carb_limit('ketogenic', self.client_profile.daily_calories, self.client_profile.daily_fiber)
+        self.assertAlmostEqual(targets[2] * 3, limit)
+        self.assertGreater(targets[3], self.client_profile.daily_fat / 3)
+
+        day = generate_day_meals(self.client_profile, num_meals=3)
+        self.assertTrue(all(day))
+        eligible = set(meal_solvers["ketogenic"].food_names)
+        self.assertTrue(all(item['food_name'] in eligible for meal in day for item in meal))
+
+    def test_vegan_client_gets_a_full_day(self):
+        from .utils.meal_generator_new import generate_day_meals, meal_solvers, meal_targets, protein_limit
+
+        #Legumes and tofu come from the source without fiber, they must still be in the vegan table
+        vegan = meal_solvers["vegan"]
+        for food in ("tofu", "lentils", "black beans", "edamame"):
+            self.assertIn(food, vegan.food_names)
+
+        self.client_profile.dietary_preference = 'vegan'
+        day = generate_day_meals(self.client_profile, num_meals=3)
+        self.assertTrue(all(day))
+        eligible = set(vegan.food_names)
+        self.assertTrue(all(item['food_name'] in eligible for meal in day for item in meal))
+
+        #Protein beyond what vegan foods can reach moves to carbs, calories stay the same
+        self.client_profile.daily_protein = 250
+        targets = meal_targets(self.client_profile)
+        self.assertAlmostEqual(targets[1] * 3, protein_limit('vegan', self.client_profile.daily_calories))
+        self.assertAlmostEqual(targets[2] * 3, self.client_profile.daily_carbs + 250 - targets[1] * 3)
+
+    def test_food_catalog_merges_sources_into_a_snapshot(self):
+        from .utils.food_catalog import SOURCES, build_records, load_food_catalog, source_hash, snapshot_path
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            built = load_food_catalog(snapshot_dir=snapshot_dir)
+            self.assertTrue(os.path.exists(snapshot_path(source_hash(), snapshot_dir)))
+
+            #Later loads memory-map the snapshot and get the same table and version
+            loaded = load_food_catalog(snapshot_dir=snapshot_dir)
+            self.assertIsInstance(loaded.records, np.memmap)
+            self.assertEqual(loaded.version, built.version)
+            self.assertEqual(loaded.names, built.names)
+
+        #Foods listed by several CSVs appear once, and every source's foods reach the solver
+        self.assertEqual(len(built.names), len(set(built.names)))
+        complete_names = set(built.complete().names)
+        for source in SOURCES:
+            self.assertLessEqual(set(build_records(sources=[source])["name"].tolist()), complete_names)
+
+        #food_nutrition_data.csv has no fiber column, so its foods get fiber estimated from their carbs
+        lentils = built.names.index("lentils")
+        self.assertTrue(built.fiber_estimated[lentils])
+        self.assertGreater(built.nutrients[lentils][-1], 0)
+        self.assertFalse(built.fiber_estimated[built.names.index("couscous")])
+
+        #A source missing any other nutrient fails rather than dropping its foods
+        file_name, columns = SOURCES[-1]
+        without_protein = {field: column for field, column in columns.items() if field != "protein"}
+        with self.assertRaises(ValueError):
+            build_records(sources=[(file_name, without_protein)])
+
+        #Subsets index into the same records and keep the version of the sources they came from
+        complete = built.complete()
+        self.assertIs(complete.records, built.records)
+        self.assertEqual(complete.version, source_hash())
+
+    def test_solution_cache_pools_solutions_then_reuses_them(self):
+        from .utils.meal_generator_new import SolutionCache, meal_solver, meal_targets
+
+        cache = SolutionCache(max_entries=2, pool_size=3)
+        targets = meal_targets(self.client_profile)
+        key = SolutionCache.key(meal_solver, "meal", targets)
+        solves = []
+
+        def solve():
+            solves.append(1)
+            return meal_solver.solve(targets)
+
+        def fits(servings):
+            return meal_solver.within_targets(servings, targets)
+
+        #The pool is filled before any solution is reused, after that every hit skips the solver
+        pooled = [cache.get(key, fits, solve) for _ in range(3)]
+        hits = [cache.get(key, fits, solve) for _ in range(10)]
+        self.assertEqual(len(solves), 3)
+        self.assertTrue(all(any(np.array_equal(hit, solution) for solution in pooled) for hit in hits))
+
+        #Targets a few calories apart share the key, but solutions outside their band are never returned
+        nearby = [targets[0] + 2] + targets[1:]
+        self.assertEqual(SolutionCache.key(meal_solver, "meal", nearby), key)
+
+        #Least recently used keys are evicted
+        for excluded in ({"a"}, {"b"}):
+            cache.add(SolutionCache.key(meal_solver, "meal", targets, excluded), pooled[0])
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn(key, cache.pools)
+
 #Tests for workout plan generation
 class WorkoutPlanGenerationTests(TestCase):
     def setUp(self):
@@ -209,23 +387,118 @@ class WorkoutPlanGenerationTests(TestCase):
             content_type='application/json'
         )
 
+        #Repeat requests while the job is queued are given the same job
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        repeat = self.client.post(
+            f'/generate-workout-plan/{self.client_profile.id}/',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+        self.assertEqual(repeat.json()["job_id"], job_id)
+
+        #Runs the job as a worker would
+        self.assertEqual(run_pending_jobs(), 1)
+        job = self.client.get(f'/plan-jobs/{job_id}/').json()
+        self.assertEqual((job["status"], job["progress"]), ("done", 100))
+
+        #Another client and a trainer who doesn't train this client can't see the job
+        trainer = User.objects.create_user(username='other_trainer', password='pass', is_trainer=True)
+        other_client = User.objects.create_user(username='other_client', password='pass', is_client=True)
+        for user in (trainer, other_client):
+            outsider = Client()
+            outsider.force_login(user)
+            self.assertEqual(outsider.get(f'/plan-jobs/{job_id}/').status_code, 404)
+
+        #The client's own trainer can
+        self.client_profile.trainer = trainer
+        self.client_profile.save()
+        trainer_client = Client()
+        trainer_client.force_login(trainer)
+        self.assertEqual(trainer_client.get(f'/plan-jobs/{job_id}/').status_code, 200)
+
         #Assertions to check that generated plan has expected structure
-        self.assertEqual(response.status_code, 201)
-        self.assertIn("workout_plan", response.json())
-        self.assertIn("plan_id", response.json())
+        self.assertIn("workout_plan", job["result"])
+        self.assertIn("plan_id", job["result"])
 
         #Assertions to check that database entries are accurate
-        plan_id = response.json()["plan_id"]
+        plan_id = job["result"]["plan_id"]
         plan = WorkoutPlan.objects.get(id=plan_id)
         self.assertEqual(plan.client, self.client_profile)
 
         days = WorkoutPlanDay.objects.filter(workout_plan=plan)
         self.assertEqual(days.count(), 3)
 
+    def test_generator_respects_equipment_and_starts_with_compound(self):
+        from .utils.workout_generator_new import generate_workout_plan
+        import numpy as np
+
+        #Seeded generator keeps the test deterministic
+        plan = generate_workout_plan(
+            2, [["chest", "triceps"], ["back"]], "Intermediate", ["Dumbbell", "Barbell"],
+            rng=np.random.default_rng(0)
+        )
+
+        #Two muscles get 3 exercises each, a single muscle gets 4
+        self.assertEqual(len(plan["Day 1"]), 6)
+        self.assertEqual(len(plan["Day 2"]), 4)
+
+        for exercises in plan.values():
+            for exercise in exercises:
+                self.assertIn(exercise["equipment"], ["Dumbbell", "Barbell"])
+
+        #Each muscle's block starts with a compound movement and has no repeats
+        self.assertEqual(plan["Day 2"][0]["mechanics"], "Compound")
+        names = [exercise["exercise_name"] for exercise in plan["Day 2"]]
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_job_left_running_by_a_stopped_worker_stops_blocking(self):
+        from django.utils.timezone import now
+        from .jobs import STALE_JOB_TIMEOUT
+
+        #A worker was killed part way through this job
+        stale = PlanJob.objects.create(
+            client=self.client_profile, kind=PlanJob.WORKOUT_PLAN, status=PlanJob.RUNNING,
+            started_at=now() - STALE_JOB_TIMEOUT - timedelta(minutes=1)
+        )
+
+        response = self.client.post(
+            f'/generate-workout-plan/{self.client_profile.id}/',
+            data=json.dumps({"workout_days": 1, "muscle_groups_per_day": [["chest"]]}),
+            content_type='application/json'
+        )
+        self.assertNotEqual(response.json()["job_id"], stale.id)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, PlanJob.FAILED)
+
+    def test_repeat_request_only_shares_an_active_job_with_the_same_settings(self):
+        def request(days):
+            return self.client.post(
+                f'/generate-workout-plan/{self.client_profile.id}/',
+                data=json.dumps({"workout_days": days, "muscle_groups_per_day": [["chest"]] * days}),
+                content_type='application/json'
+            )
+
+        job_id = request(1).json()["job_id"]
+
+        #The same settings get the queued job back
+        response = request(1)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["job_id"], job_id)
+
+        #Different settings are rejected rather than handed a plan they didn't ask for
+        response = request(2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["job_id"], job_id)
+        self.assertEqual(PlanJob.objects.filter(client=self.client_profile).count(), 1)
+
 #Tests for gamification system
 class GamificationTests(TestCase):
     def setUp(self):
         self.User = get_user_model()
+
+        #Ranked leaderboards are cached per season, and season ids can be reused between tests
+        cache.clear()
         
         #Creates account for trainer and respective trainer profile
         self.trainer_user = self.User.objects.create_user(
@@ -288,6 +561,13 @@ class GamificationTests(TestCase):
         entry = Leaderboard.objects.get(client=self.client_profile, season=self.season)
         self.assertEqual(entry.points, 20)
 
+        #Later awards add to the total and move the entry's updated_at on
+        Leaderboard.objects.filter(pk=entry.pk).update(updated_at=entry.updated_at - timedelta(days=1))
+        self.client.post("/assign-points/", data=json.dumps(payload), content_type="application/json")
+        awarded = Leaderboard.objects.get(pk=entry.pk)
+        self.assertEqual(awarded.points, 40)
+        self.assertGreater(awarded.updated_at, entry.updated_at - timedelta(days=1))
+
     def test_assign_points_without_active_season(self):
         #Deactivates season
         self.season.is_active = False
@@ -310,6 +590,90 @@ class GamificationTests(TestCase):
         self.assertIn("error", response.json())
         self.assertEqual(response.json()["error"], "No active season found.")
 
+    def test_leaderboard_is_ranked_from_cache_and_rebuilt_after_award(self):
+        clients = [self.client_profile]
+        for name in ('client2', 'client3'):
+            user = self.User.objects.create_user(username=name, password='pass', is_client=True)
+            clients.append(ClientProfile.objects.create(
+                user=user, date_of_birth=date(2000, 1, 1), gender='male', height=175, weight=70, trainer=self.trainer_user
+            ))
+
+        def award(client, points):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    "/assign-points/",
+                    data=json.dumps({"client_id": client.id, "points": points}),
+                    content_type="application/json"
+                )
+
+        award(clients[0], 10)
+        award(clients[1], 30)
+        award(clients[2], 10)
+        self.client.get("/get-leaderboard/")
+
+        #Awards are added to the stored total and the next read rebuilds the view at the new version
+        award(clients[0], 25)
+        self.assertEqual(Leaderboard.objects.get(client=clients[0], season=self.season).points, 35)
+        with self.assertNumQueries(5):
+            self.client.get("/get-leaderboard/")
+
+        #Session, user, trainer profile and season, the ranking itself comes from the cache
+        with self.assertNumQueries(4):
+            response = self.client.get("/get-leaderboard/", {"limit": 2})
+        self.assertEqual(
+            [(row["rank"], row["client_username"], row["points"]) for row in response.json()["leaderboard"]],
+            [(1, "client1", 35), (2, "client2", 30)]
+        )
+
+        #Clients see their own rank even outside the top entries
+        self.client.force_login(clients[2].user)
+        response = self.client.get("/get-leaderboard/", {"limit": 1})
+        self.assertEqual(response.json()["my_rank"], 3)
+        self.assertEqual(response.json()["my_points"], 10)
+
+    def test_bulk_award_applies_every_increment_and_returns_ranks(self):
+        clients = [self.client_profile]
+        for i in range(3):
+            user = self.User.objects.create_user(username=f'group{i}', password='pass', is_client=True)
+            clients.append(ClientProfile.objects.create(
+                user=user, date_of_birth=date(2000, 1, 1), gender='male', height=175, weight=70, trainer=self.trainer_user
+            ))
+        existing = Leaderboard.objects.create(client=clients[0], trainer=self.trainer_profile, season=self.season, points=5)
+        last_week = existing.updated_at - timedelta(days=7)
+        Leaderboard.objects.filter(pk=existing.pk).update(updated_at=last_week)
+
+        awards = [{"client_id": client.id, "points": 10 * (i + 1)} for i, client in enumerate(clients)]
+        awards.append({"client_id": clients[1].id, "points": 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/assign-points/bulk/", data=json.dumps({"awards": awards}), content_type="application/json")
+
+        results = {row["client_id"]: (row["total_points"], row["rank"]) for row in response.json()["results"]}
+        self.assertEqual(results, {
+            clients[0].id: (15, 4),
+            clients[1].id: (21, 3),
+            clients[2].id: (30, 2),
+            clients[3].id: (40, 1),
+        })
+        self.assertEqual(Leaderboard.objects.filter(season=self.season).count(), 4)
+        existing.refresh_from_db()
+        self.assertGreater(existing.updated_at, last_week)
+
+        #Clients of other trainers are rejected without awarding anything
+        other_user = self.User.objects.create_user(username='other', password='pass', is_client=True)
+        other = ClientProfile.objects.create(user=other_user, date_of_birth=date(2000, 1, 1), gender='male', height=175, weight=70)
+        awards = [{"client_id": clients[0].id, "points": 5}, {"client_id": other.id, "points": 5}]
+        response = self.client.post("/assign-points/bulk/", data=json.dumps({"awards": awards}), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["client_ids"], [other.id])
+        self.assertEqual(Leaderboard.objects.get(client=clients[0], season=self.season).points, 15)
+
+        #Zero, negative and fractional points are rejected before anything is awarded
+        for points in (0, -20, 2.5, "ten"):
+            awards = [{"client_id": clients[0].id, "points": 5}, {"client_id": clients[1].id, "points": points}]
+            response = self.client.post("/assign-points/bulk/", data=json.dumps({"awards": awards}), content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Leaderboard.objects.get(client=clients[0], season=self.season).points, 15)
+
 class WeightUpdateTests(TestCase):
     #Creates user and client profile with dummy data
     def setUp(self):
@@ -359,6 +723,92 @@ class WeightUpdateTests(TestCase):
         self.client_profile.refresh_from_db()
         self.assertEqual(self.client_profile.weight, 72.5)
 
+    def test_weight_progress_is_range_limited_and_downsampled(self):
+        WeightProgress.objects.bulk_create([
+            WeightProgress(client=self.client_profile, date=date(2023, 1, 1) + timedelta(days=i), weight=80 - i * 0.01)
+            for i in range(1000)
+        ])
+
+        #Downsampled to the requested number of points, keeping the first and last entries
+        response = self.client.get('/api/getWeightProgress', {'points': 50})
+        data = response.json()["weight_progress"]
+        self.assertEqual(len(data), 50)
+        self.assertEqual(data[0]["date"], "2023-01-01")
+        self.assertEqual(data[-1]["date"], str(date(2023, 1, 1) + timedelta(days=999)))
+
+        #Short ranges are returned in full
+        response = self.client.get('/api/getWeightProgress', {'from': '2023-02-01', 'to': '2023-02-10'})
+        data = response.json()["weight_progress"]
+        self.assertEqual([entry["date"] for entry in data], [f"2023-02-{day:02d}" for day in range(1, 11)])
+
+        response = self.client.get('/api/getWeightProgress', {'from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_weekly_rollup_is_maintained_on_write_and_matches_backfill(self):
+        #2024-04-01 to 2024-04-03 are in ISO week 14, 2024-04-08 is in week 15
+        for entry_date, weight in [("2024-04-02", 74), ("2024-04-01", 76), ("2024-04-03", 75), ("2024-04-08", 73)]:
+            self.client.post(
+                "/api/updateWeight",
+                data=json.dumps({"weight": weight, "date": entry_date}),
+                content_type="application/json"
+            )
+
+        def rollups():
+            return list(WeeklyWeightRollup.objects.filter(client=self.client_profile).values(
+                'iso_year', 'iso_week', 'min_weight', 'max_weight', 'mean_weight', 'last_weight', 'last_date', 'count'
+            ))
+
+        maintained = rollups()
+        self.assertEqual([(row['iso_week'], row['count']) for row in maintained], [(14, 3), (15, 1)])
+        self.assertEqual((maintained[0]['min_weight'], maintained[0]['max_weight']), (74, 76))
+        self.assertAlmostEqual(maintained[0]['mean_weight'], 75)
+        self.assertEqual((maintained[0]['last_weight'], str(maintained[0]['last_date'])), (75, "2024-04-03"))
+
+        call_command('backfill_weight_rollups', stdout=StringIO())
+        self.assertEqual(rollups(), maintained)
+
+    def test_bulk_import_upserts_entries_and_applies_latest_weight(self):
+        WeightProgress.objects.create(client=self.client_profile, date=date(2024, 3, 1), weight=79)
+        entries = [{"date": str(date(2024, 1, 1) + timedelta(days=i)), "weight": 80 - i * 0.05} for i in range(100)]
+
+        response = self.client.post("/api/importWeights", data=json.dumps(entries), content_type="application/json")
+        self.assertEqual(response.json()["imported"], 100)
+
+        #The existing entry on 2024-03-01 was replaced rather than duplicated
+        self.assertEqual(WeightProgress.objects.filter(client=self.client_profile).count(), 100)
+        self.assertEqual(WeightProgress.objects.get(client=self.client_profile, date=date(2024, 3, 1)).weight, 80 - 60 * 0.05)
+        self.client_profile.refresh_from_db()
+        self.assertAlmostEqual(self.client_profile.weight, 80 - 99 * 0.05)
+        self.assertEqual(
+            sum(WeeklyWeightRollup.objects.filter(client=self.client_profile).values_list('count', flat=True)), 100
+        )
+
+        #CSV imports of older entries don't change the current weight
+        csv_data = "date,weight\n2023-12-30,81\n2023-12-31,80.5\n"
+        response = self.client.post("/api/importWeights", data=csv_data, content_type="text/csv")
+        self.assertEqual(response.json()["imported"], 2)
+        self.client_profile.refresh_from_db()
+        self.assertAlmostEqual(self.client_profile.weight, 80 - 99 * 0.05)
+
+        #CSVs exported by spreadsheet tools start with a byte order mark, it isn't part of the first header
+        response = self.client.post("/api/importWeights", data="\ufeffdate,weight\n2023-12-29,81.5\n".encode("utf-8"), content_type="text/csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["imported"], 1)
+        self.assertTrue(WeightProgress.objects.filter(client=self.client_profile, date=date(2023, 12, 29), weight=81.5).exists())
+
+        response = self.client.post("/api/importWeights", data="date,weight\n2024-13-01,80\n", content_type="text/csv")
+        self.assertEqual(response.status_code, 400)
+
+        #Non-finite and non-positive weights are rejected with the entry named, nothing is stored
+        count = WeightProgress.objects.filter(client=self.client_profile).count()
+        for weight in ("inf", "nan", "-80", "0"):
+            response = self.client.post("/api/importWeights", data=f"date,weight\n2024-06-01,80\n2024-06-02,{weight}\n", content_type="text/csv")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("Entry 2", response.json()["error"])
+        response = self.client.post("/api/importWeights", data='[{"date": "2024-06-01", "weight": Infinity}]', content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(WeightProgress.objects.filter(client=self.client_profile).count(), count)
+
 
 
 
@@ -366,6 +816,9 @@ class KNNRecommenderTests(TestCase):
     def setUp(self):
         self.client = Client()
 
+        #The recommender index lives for the whole process, so it's cleared between tests
+        recommender_index.reset()
+
         #Creates client who will receive recommendations
         self.target_user = User.objects.create_user(
             username='target_user', password='pass', is_client=True
@@ -452,3 +905,423 @@ class KNNRecommenderTests(TestCase):
             self.assertIn("Plan 4", recommended_names)
             self.assertIn("Plan 5", recommended_names)
             self.assertNotIn("Yoga for Seniors", recommended_names)
+
+    def test_recommendations_use_constant_query_count(self):
+        #Builds the index up front so only the response building is measured
+        get_top_recommended_workouts_for_client(self.target_client)
+
+        #Session, user, client profile, precomputed lookup, neighbours' ratings and one annotated plan query
+        with self.assertNumQueries(6):
+            response = self.client.get('/get-recommended-workouts/')
+
+        recommendations = response.json()["recommendations"]
+        self.assertEqual(len(recommendations), 5)
+        for rec in recommendations:
+            self.assertTrue(rec["rated_by"].startswith("similar"))
+            self.assertIsNone(rec["client_rating"])
+
+    def test_index_is_updated_incrementally(self):
+        #First request builds the index
+        self.assertEqual(len(get_top_recommended_workouts_for_client(self.target_client)), 5)
+        self.assertEqual(recommender_index.size, 6)
+
+        #Moving the outlier next to the target and giving them a new plan is picked up without a rebuild
+        with self.captureOnCommitCallbacks(execute=True):
+            self.different_client.date_of_birth = date(1998, 1, 1)
+            self.different_client.gender = 'male'
+            self.different_client.height = 175
+            self.different_client.weight = 70
+            self.different_client.goal = 'gain_muscle'
+            self.different_client.activity_level = 'moderately_active'
+            self.different_client.save()
+
+        with self.assertNumQueries(0):
+            nearest = recommender_index.nearest_client_ids(self.target_client, 1)
+        self.assertEqual(nearest, [self.different_client.id])
+
+        #Rating a plan adds the target to the index, and their rated plans are no longer recommended
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkoutPlanRating.objects.create(
+                client=self.target_client, workout_plan=self.outlier_plan, rating=5, workout_name="Copied"
+            )
+        self.assertEqual(recommender_index.size, 7)
+        self.assertNotIn(self.outlier_plan.id, [plan.id for plan in get_top_recommended_workouts_for_client(self.target_client)])
+
+        #Deleting the only rating removes the client again
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkoutPlanRating.objects.filter(client=self.target_client).delete()
+        self.assertEqual(recommender_index.size, 6)
+
+    def test_ratings_saved_by_another_process_are_not_recommended(self):
+        recommended = get_top_recommended_workouts_for_client(self.target_client)
+        plan = recommended.first()
+
+        #bulk_create sends no signals, like a rating saved by another worker, so the index isn't told
+        WorkoutPlanRating.objects.bulk_create([
+            WorkoutPlanRating(client=self.target_client, workout_plan=plan, rating=4, workout_name="Copied")
+        ])
+        self.assertNotIn(plan.id, [p.id for p in get_top_recommended_workouts_for_client(self.target_client)])
+
+    def test_encoder_scales_features_and_one_hot_encodes_categories(self):
+        encoder = ClientFeatureEncoder()
+        raw = encoder.raw_matrix(ClientProfile.objects.all())
+        encoder.fit(raw)
+        encoded = encoder.transform(raw)
+
+        #Numeric columns are standardised so height and weight don't dominate the distance
+        numeric = encoded[:, :4] / encoder.column_weights[:4]
+        self.assertTrue(np.allclose(numeric.mean(axis=0), 0))
+        self.assertTrue(np.allclose(numeric.std(axis=0), 1))
+
+        #Gender is matched case-insensitively and goal has one column per choice
+        row = encoder.raw_matrix([{"id": 0, "date_of_birth": date(2000, 1, 1), "height": 180, "weight": 80,
+                                    "activity_level": "very_active", "gender": "Male", "goal": "gain_muscle"}])[0]
+        self.assertEqual(list(row[4:]), [1, 0, 0, 0, 0, 1])
+        self.assertEqual(row[3], 4)
+
+    def test_precomputed_recommendations_are_served(self):
+        call_command('precompute_recommendations', stdout=StringIO())
+
+        #Every client gets a row per recommended plan, the target gets the 5 similar clients' plans
+        target_rows = RecommendedWorkout.objects.filter(client=self.target_client)
+        self.assertEqual(target_rows.count(), 5)
+        self.assertNotIn(self.outlier_plan.id, target_rows.values_list('workout_plan_id', flat=True))
+
+        #Plans rated after the precompute are filtered out at read time
+        rated_plan = target_rows.first().workout_plan
+        WorkoutPlanRating.objects.create(client=self.target_client, workout_plan=rated_plan, rating=4)
+
+        response = self.client.get('/get-recommended-workouts/')
+        plan_ids = [rec["plan_id"] for rec in response.json()["recommendations"]]
+        self.assertEqual(len(plan_ids), 4)
+        self.assertNotIn(rated_plan.id, plan_ids)
+
+class ExerciseCatalogTests(TestCase):
+    def test_catalog_is_loaded_once_and_indexed(self):
+        from .utils.exercise_catalog import get_exercise_catalog
+
+        #Repeated calls return the same cached catalog while the CSV is unchanged
+        catalog = get_exercise_catalog()
+        self.assertIs(catalog, get_exercise_catalog())
+
+        #Every row in the chest index targets chest
+        chest_rows = catalog.rows_for(catalog.by_muscle, "chest")
+        self.assertGreater(len(chest_rows), 0)
+        for row_id in chest_rows:
+            self.assertIn("chest", catalog.df.iloc[row_id]["muscle_list"])
+
+        #Indexes on single valued columns cover every row exactly once
+        total = sum(len(rows) for rows in catalog.by_equipment.values())
+        self.assertEqual(total, (catalog.df["equipment_norm"] != "").sum())
+
+    def test_refresh_exercise_matches_filters(self):
+        payload = {
+            "target_muscle": "Chest",
+            "mechanics": "Compound",
+            "allowed_equipment": ["Dumbbell", "Barbell"]
+        }
+
+        response = self.client.post(
+            "/refresh-exercise/",
+            data=json.dumps(payload),
+            content_type="application/json"
+        )
+
+        #The replacement exercise matches the muscle, mechanics and equipment of the original
+        self.assertEqual(response.status_code, 200)
+        exercise = response.json()["new_exercise"]
+        self.assertEqual(exercise["target_muscle"].strip(), "Chest")
+        self.assertEqual(exercise["mechanics"], "Compound")
+        self.assertIn(exercise["equipment"], ["Dumbbell", "Barbell"])
+
+        #No equipment means no candidates
+        payload["allowed_equipment"] = []
+        response = self.client.post(
+            "/refresh-exercise/",
+            data=json.dumps(payload),
+            content_type="application/json"
+        )
+        self.assertIsNone(response.json()["new_exercise"])
+
+
+class SavedWorkoutListingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='saver', password='pass', is_client=True)
+        self.profile = ClientProfile.objects.create(
+            user=self.user,
+            date_of_birth=date(1998, 1, 1),
+            gender='male',
+            height=175,
+            weight=70,
+            goal='gain_muscle',
+            activity_level='moderately_active',
+        )
+        self.client.force_login(self.user)
+
+    #Creates a rated plan with two days and adds it to the client's shortlist
+    def save_plan(self, name):
+        user = User.objects.create_user(username=f'rater_{name}', password='pass', is_client=True)
+        rater = ClientProfile.objects.create(
+            user=user, date_of_birth=date(1990, 1, 1), gender='female', height=160, weight=55
+        )
+        plan = WorkoutPlan.objects.create(client=rater, training_frequency=2)
+        for day_number in (2, 1):
+            WorkoutPlanDay.objects.create(workout_plan=plan, day_number=day_number, exercises=[{"exercise_name": name}])
+        WorkoutPlanRating.objects.create(client=rater, workout_plan=plan, rating=5, workout_name=name)
+        SavedWorkout.objects.create(client=self.profile, workout_plan=plan)
+
+    def test_saved_workouts_query_count_is_independent_of_shortlist_size(self):
+        self.save_plan("Push")
+
+        #Session, user, client profile, annotated plans and prefetched days
+        with self.assertNumQueries(5):
+            response = self.client.get('/get-saved-recommended-workouts/')
+        saved = response.json()["saved_workouts"]
+        self.assertEqual(saved[0]["workout_name"], "Push")
+        self.assertEqual(saved[0]["rated_by"], "rater_Push")
+        self.assertEqual(list(saved[0]["workout_plan"]), ["Day 1", "Day 2"])
+
+        for name in ("Pull", "Legs", "Arms"):
+            self.save_plan(name)
+
+        with self.assertNumQueries(5):
+            response = self.client.get('/get-saved-recommended-workouts/')
+        names = [item["workout_name"] for item in response.json()["saved_workouts"]]
+        self.assertEqual(names, ["Push", "Pull", "Legs", "Arms"])
+
+
+class PlanPersistenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', password='pass', is_client=True)
+        self.profile = ClientProfile.objects.create(
+            user=self.user,
+            date_of_birth=date(1995, 1, 1),
+            gender='female',
+            height=165,
+            weight=60,
+        )
+
+    #INSERT statements run by func
+    def inserts_during(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [query for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+
+    def test_meal_plan_is_replaced_with_one_insert(self):
+        food = {'food_name': 'Oats', 'weight_in_grams': 40, 'calories': 150, 'protein': 5, 'carbs': 27, 'fats': 3}
+        replace_meal_plan(self.profile, [[food], [dict(food, food_name='Eggs')]])
+
+        day_meals = [[dict(food, food_name=f'Food {meal}-{i}') for i in range(4)] for meal in range(3)]
+        inserts = self.inserts_during(lambda: replace_meal_plan(self.profile, day_meals))
+        self.assertEqual(len(inserts), 1)
+
+        meals = MealPlan.objects.filter(client=self.profile)
+        self.assertEqual(meals.count(), 12)
+        self.assertFalse(meals.filter(food_name__in=['Oats', 'Eggs']).exists())
+        self.assertEqual(sorted(set(meals.values_list('meal_number', flat=True))), [1, 2, 3])
+
+    def test_meal_plans_of_many_clients_are_replaced_together(self):
+        other_user = User.objects.create_user(username='writer2', password='pass', is_client=True)
+        other = ClientProfile.objects.create(user=other_user, date_of_birth=date(1995, 1, 1), gender='male', height=180, weight=80)
+        food = {'food_name': 'Rice', 'weight_in_grams': 100, 'calories': 130, 'protein': 3, 'carbs': 28, 'fats': 0}
+        replace_meal_plan(self.profile, [[food]])
+
+        inserts = self.inserts_during(lambda: replace_meal_plans({
+            self.profile.id: [[dict(food, food_name='Beans')], [food]],
+            other.id: [[food, dict(food, food_name='Tofu')]],
+        }))
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            sorted(MealPlan.objects.values_list('client_id', 'meal_number', 'food_name')),
+            sorted([(self.profile.id, 1, 'Beans'), (self.profile.id, 2, 'Rice'), (other.id, 1, 'Rice'), (other.id, 1, 'Tofu')])
+        )
+
+    def test_workout_plan_days_are_created_in_bulk(self):
+        WorkoutPlan.objects.create(client=self.profile, training_frequency=1)
+        days = [(day_number, [{"exercise_name": f"Exercise {day_number}"}]) for day_number in range(1, 5)]
+
+        #One insert for the plan and one for all of its days
+        inserts = self.inserts_during(lambda: create_workout_plan(self.profile, days, replace_existing=True))
+        self.assertEqual(len(inserts), 2)
+
+        plan = WorkoutPlan.objects.get(client=self.profile)
+        self.assertEqual(plan.training_frequency, 4)
+        self.assertEqual(list(plan.days.order_by('day_number').values_list('day_number', flat=True)), [1, 2, 3, 4])
+
+
+class ClientProfileMacroTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='macros', password='pass', is_client=True)
+        self.trainer = User.objects.create_user(username='coach', password='pass', is_trainer=True)
+        self.profile = ClientProfile.objects.create(
+            user=self.user,
+            date_of_birth=date(1990, 1, 1),
+            gender='male',
+            height=180,
+            weight=80,
+        )
+
+    #SQL of the UPDATE statements run by func
+    def updates_during(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+
+    def test_unrelated_save_only_writes_changed_columns(self):
+        calculated_at = self.profile.macronutrient_last_updated
+        self.profile.trainer = self.trainer
+
+        updates = self.updates_during(self.profile.save)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"trainer_id"', updates[0])
+        self.assertNotIn('"daily_calories"', updates[0])
+        self.assertEqual(self.profile.macronutrient_last_updated, calculated_at)
+
+        #Nothing changed so nothing is written
+        self.assertEqual(self.updates_during(self.profile.save), [])
+
+    def test_macro_inputs_trigger_recalculation(self):
+        calories = self.profile.daily_calories
+        self.profile.goal = 'lose_weight'
+
+        updates = self.updates_during(self.profile.save)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"daily_calories"', updates[0])
+        self.assertEqual(self.profile.daily_calories, calories - 500)
+
+        reloaded = ClientProfile.objects.get(id=self.profile.id)
+        self.assertEqual(reloaded.daily_calories, calories - 500)
+        self.assertEqual(reloaded.changed_fields(), set())
+
+    def test_partial_save_leaves_other_changes_for_the_next_save(self):
+        calories = self.profile.daily_calories
+        self.profile.trainer = self.trainer
+        self.profile.goal = 'lose_weight'
+
+        #Only the trainer is written, the goal change is still pending so macros aren't recalculated yet
+        self.profile.save(update_fields=['trainer'])
+        self.assertEqual(self.profile.changed_fields(), {'goal'})
+        reloaded = ClientProfile.objects.get(id=self.profile.id)
+        self.assertEqual((reloaded.trainer_id, reloaded.goal, reloaded.daily_calories), (self.trainer.id, 'maintain_weight', calories))
+
+        #A full save afterwards writes the goal and the recalculated macros
+        self.profile.save()
+        reloaded = ClientProfile.objects.get(id=self.profile.id)
+        self.assertEqual((reloaded.goal, reloaded.daily_calories), ('lose_weight', calories - 500))
+
+    def test_bulk_recompute_matches_model_calculation(self):
+        profiles = [self.profile]
+        for i, (gender, goal, activity) in enumerate([
+            ('female', 'lose_weight', 'sedentary'),
+            ('Male', 'gain_muscle', 'super_active'),
+            ('other', 'maintain_weight', 'unknown'),
+        ]):
+            user = User.objects.create_user(username=f'bulk{i}', password='pass', is_client=True)
+            profiles.append(ClientProfile.objects.create(
+                user=user, date_of_birth=date(1985 + i, 12, 31), gender=gender, height=160 + i,
+                weight=60.5 + i, goal=goal, activity_level=activity, protein_multiplier=1.6,
+            ))
+        expected = {profile.id: profile.calculate_macronutrients() for profile in profiles}
+
+        #Stale targets are rewritten, up to date ones are left alone
+        ClientProfile.objects.filter(id=self.profile.id).update(daily_calories=1, daily_fiber=None)
+        out = StringIO()
+        call_command('recompute_macros', '--chunk-size', '2', stdout=out)
+        self.assertIn('4 clients, 1 updated', out.getvalue())
+
+        for profile in ClientProfile.objects.filter(id__in=expected):
+            for name, value in expected[profile.id].items():
+                self.assertEqual(getattr(profile, name), value)
+
+
+class TrainerRosterTests(TestCase):
+    def setUp(self):
+        self.trainer = User.objects.create_user(username='roster_trainer', password='pass', is_trainer=True)
+        TrainerProfile.objects.create(user=self.trainer)
+        self.client.force_login(self.trainer)
+
+    def add_clients(self, count, start=0):
+        for i in range(start, start + count):
+            user = User.objects.create_user(username=f'roster{i:03d}', password='pass', is_client=True)
+            ClientProfile.objects.create(
+                user=user, date_of_birth=date(1990, 1, 1), gender='female', height=165, weight=60 + i % 7,
+                goal='lose_weight' if i % 2 else 'gain_muscle', trainer=self.trainer,
+            )
+
+    def test_roster_pages_follow_cursor_with_constant_queries(self):
+        self.add_clients(5)
+
+        #Session, user, trainer profile check and one query for the page
+        with self.assertNumQueries(4):
+            response = self.client.get('/trainer/clients/', {'limit': 2, 'fields': 'id,username'})
+        first = response.json()
+        self.assertEqual([set(client) for client in first['clients']], [{'id', 'username'}] * 2)
+
+        self.add_clients(20, start=5)
+        with self.assertNumQueries(4):
+            self.client.get('/trainer/clients/', {'limit': 20})
+
+        #Walking the cursor visits every client once in sort order
+        usernames, cursor = [], None
+        while True:
+            params = {'limit': 7, 'sort': '-weight', 'fields': 'username,weight'}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.client.get('/trainer/clients/', params).json()
+            usernames += [client['username'] for client in page['clients']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(usernames), 25)
+        self.assertEqual(len(set(usernames)), 25)
+        weights = [60 + int(name[-3:]) % 7 for name in usernames]
+        self.assertEqual(weights, sorted(weights, reverse=True))
+
+    def test_roster_filters_and_rejects_unknown_fields(self):
+        self.add_clients(6)
+        response = self.client.get('/trainer/clients/', {'goal': 'lose_weight', 'fields': 'goal'})
+        self.assertEqual([client['goal'] for client in response.json()['clients']], ['lose_weight'] * 3)
+
+        response = self.client.get('/trainer/clients/', {'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TrainerSearchTests(TestCase):
+    def setUp(self):
+        for username, bio in [
+            ('Alex_Strength', 'Powerlifting coach'),
+            ('alexandra', 'Yoga and mobility'),
+            ('sam', 'Strength and conditioning for runners'),
+            ('malex', None),
+        ]:
+            user = User.objects.create_user(username=username, password='pass', is_trainer=True)
+            TrainerProfile.objects.create(user=user, bio=bio)
+
+    def search(self, **params):
+        return self.client.get('/search_trainers/', params).json()
+
+    def test_username_search_matches_prefixes_ignoring_case(self):
+        result = self.search(username='ALEX')
+        self.assertEqual([trainer['username'] for trainer in result['trainers']], ['Alex_Strength', 'alexandra'])
+        self.assertFalse(result['has_more'])
+
+        #Results are capped and paged
+        result = self.search(username='alex', limit=1)
+        self.assertEqual([trainer['username'] for trainer in result['trainers']], ['Alex_Strength'])
+        self.assertTrue(result['has_more'])
+        result = self.search(username='alex', limit=1, offset=1)
+        self.assertEqual([trainer['username'] for trainer in result['trainers']], ['alexandra'])
+
+    def test_text_search_matches_words_in_usernames_and_bios(self):
+        result = self.search(q='strength')
+        self.assertEqual({trainer['username'] for trainer in result['trainers']}, {'Alex_Strength', 'sam'})
+
+        result = self.search(q='yoga mob')
+        self.assertEqual([trainer['username'] for trainer in result['trainers']], ['alexandra'])
+
+        #Bios and usernames stay in sync with edits
+        trainer = TrainerProfile.objects.get(user__username='malex')
+        trainer.bio = 'Mobility specialist'
+        trainer.save()
+        result = self.search(q='mobility')
+        self.assertEqual({trainer['username'] for trainer in result['trainers']}, {'alexandra', 'malex'})
@@ -0,0 +1,80 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Lower
+from .models import TrainerProfile
+
+#Trainer search used by clients looking for a trainer
+#Username prefixes are matched through the lowercase username index, and words in usernames and bios
+#through the users_trainersearch FTS5 table created in migration 0005 when SQLite supports it
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+#Highest code point, appended to a prefix to get the end of its range in the index
+PREFIX_END = "\U0010ffff"
+
+_fts_available = None
+
+
+#Whether the FTS5 table exists, checked once per process
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = (
+            connection.vendor == 'sqlite'
+            and 'users_trainersearch' in connection.introspection.table_names()
+        )
+    return _fts_available
+
+
+#Trainers whose username starts with the query, ignoring case
+#Compares lower(username) against a range so SQLite can walk the expression index instead of scanning
+def _prefix_matches(query):
+    prefix = query.lower()
+    return (
+        TrainerProfile.objects
+        .alias(username_lower=Lower('user__username'))
+        .filter(username_lower__gte=prefix, username_lower__lt=prefix + PREFIX_END)
+        .order_by('username_lower', 'id')
+    )
+
+
+#Ids of trainers whose username or bio contain words starting with each word of the query, best match first
+def _token_match_ids(words, limit, offset):
+    if fts_available():
+        match = ' '.join(f'"{word}"*' for word in words)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM users_trainersearch WHERE users_trainersearch MATCH %s ORDER BY rank LIMIT %s OFFSET %s",
+                [match, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    #Without FTS5 every word has to appear somewhere in the username or bio
+    trainers = TrainerProfile.objects.all()
+    for word in words:
+        trainers = trainers.filter(Q(user__username__icontains=word) | Q(bio__icontains=word))
+    return list(trainers.order_by('id').values_list('id', flat=True)[offset:offset + limit])
+
+
+#One page of trainers matching the query, returns the trainers and whether there are more
+#mode is "prefix" for username search-as-you-type or "text" for words anywhere in usernames and bios
+def search_trainers(query, mode='prefix', limit=DEFAULT_PAGE_SIZE, offset=0):
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    offset = max(offset, 0)
+
+    #One extra result is fetched to tell whether there is another page
+    if mode == 'text':
+        words = re.findall(r'\w+', query.lower())
+        if not words:
+            return [], False
+        ids = _token_match_ids(words, limit + 1, offset)
+        trainers_by_id = TrainerProfile.objects.select_related('user').in_bulk(ids)
+        trainers = [trainers_by_id[trainer_id] for trainer_id in ids if trainer_id in trainers_by_id]
+    else:
+        if not query:
+            return [], False
+        trainers = list(_prefix_matches(query).select_related('user')[offset:offset + limit + 1])
+
+    return trainers[:limit], len(trainers) > limit
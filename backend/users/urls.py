@@ -12,6 +12,7 @@ urlpatterns = [
     path('api/getUserType', views.get_user_type, name='get_user_type'),
     path('api/getUserData', views.get_user_data, name='get_user_data'),
     path('api/updateWeight', views.update_weight, name='update_weight' ),
+    path('api/importWeights', views.import_weights, name='import_weights'),
     path('api/getWeightProgress', views.get_weight_progress, name='get_weight_progress'),
     path('api/getClientWeightProgress/<int:client_id>/', views.get_client_weight_progress, name='get_client_weight_progress'),
     path('search_trainers/', views.search_trainers, name='search_trainers'),
@@ -19,11 +20,13 @@ urlpatterns = [
     path('view_requests/', views.view_requests, name='view_requests'),
     path('respond_to_request/<int:request_id>/', views.respond_to_request, name='respond_to_request'),
     path('trainer/clients/', views.get_trainer_clients, name='trainer_clients'),
+    path('trainer/clients/weight-trends/', views.get_roster_weight_trends, name='roster_weight_trends'),
     path("get-client-saved-workouts/<int:client_id>/", views.get_client_saved_workouts, name="get_client_saved_workouts"),
     path("generate-meal-plan/<int:client_id>/", views.generate_meal_plan, name="generate_meal_plan"),
     path('regenerate-meal/<int:client_id>/<int:meal_number>/', views.regenerate_single_meal),
     path('get-saved-meal-plan/<int:client_id>/', views.get_saved_meal_plan, name='get_saved_meal_plan'),
     path('generate-workout-plan/<int:client_id>/', views.generate_workout_plan_view, name='generate_workout_plan'),
+    path('plan-jobs/<int:job_id>/', views.get_plan_job, name='get_plan_job'),
     path('save-workout-plan/<int:client_id>/', views.save_workout_plan, name='save_workout_plan'),
     path('get-saved-workout-plan/<int:client_id>/', views.get_saved_workout_plan, name='get-saved-workout-plan'),
     path('rate-workout-plan/', views.rate_workout_plan, name='rate_workout_plan'),
@@ -36,6 +39,7 @@ urlpatterns = [
     path("get-workout-plan-by-id/<int:plan_id>/", views.get_workout_plan_by_id, name="get-workout-plan-by-id"),
     path("create-season/", views.create_season, name="create_season"),
     path('assign-points/', views.assign_points, name='assign_points'),
+    path('assign-points/bulk/', views.assign_points_bulk, name='assign_points_bulk'),
     path('get-leaderboard/', views.get_leaderboard, name='get_leaderboard'),
     path('get-client-points/<int:client_id>/', views.get_client_points, name='get_client_points'),
     path('refresh-exercise/', views.refresh_exercise, name='refresh_exercise'),
@@ -0,0 +1,173 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+#Path to the exercise CSV shipped with the app
+base_path = os.path.dirname(os.path.abspath(__file__))
+EXERCISE_CSV = os.path.join(base_path, "exercise_database_full.csv")
+
+#Columns the rest of the app relies on
+REQUIRED_COLUMNS = [
+    "Exercise",
+    "Difficulty Level",
+    "Target Muscle Group",
+    "Primary Equipment",
+    "Exercise Classification",
+    "Mechanics"
+]
+
+#Maximum number of memoised refresh lookups kept per catalog
+CANDIDATE_CACHE_SIZE = 1024
+
+
+#Helper that lower-cases and strips a text column, missing values become empty strings
+def _normalise(column):
+    return column.fillna("").astype(str).str.strip().str.lower()
+
+
+#Helper that builds an inverted index from key column(s) to sorted arrays of row positions
+#The index of keys holds the row positions, passing a DataFrame builds a composite index keyed by tuples
+def _build_index(keys):
+    frame = keys.to_frame() if isinstance(keys, pd.Series) else keys
+    columns = list(frame.columns)
+    frame = frame.assign(row_id=frame.index.to_numpy(dtype=np.int64)).reset_index(drop=True)
+
+    index = {}
+    for key, rows in frame.groupby(columns if len(columns) > 1 else columns[0])["row_id"]:
+        if key:
+            index[key] = np.sort(rows.to_numpy())
+    return index
+
+
+#Exercise dataset loaded once per worker, with normalised columns and inverted indexes
+class ExerciseCatalog:
+    def __init__(self, csv_file=EXERCISE_CSV):
+        self.csv_file = csv_file
+
+        #mtime is recorded before reading so an edit during the read triggers another reload
+        self.mtime = os.path.getmtime(csv_file)
+
+        #Load CSV remove any potential trailing spaces
+        df = pd.read_csv(csv_file)
+        df.columns = [col.strip() for col in df.columns]
+
+        missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+        if missing:
+            #If CSV has wrong structure, raise error
+            raise ValueError(f"Missing columns in the CSV: {missing}. Found: {list(df.columns)}")
+
+        #Row positions are used as row IDs by every index, so the frame is given a clean 0..n-1 index
+        df = df.reset_index(drop=True)
+
+        #Precomputed normalised columns so requests never have to strip/lower strings again
+        df["classification_norm"] = _normalise(df["Exercise Classification"])
+        df["mechanics_norm"] = _normalise(df["Mechanics"])
+        df["equipment_norm"] = _normalise(df["Primary Equipment"])
+
+        #Target muscle groups can be comma separated, so they are split into lists
+        df["muscle_list"] = (
+            df["Target Muscle Group"].fillna("").astype(str).str.lower().str.split(",")
+            .map(lambda muscles: [m.strip() for m in muscles if m.strip()])
+        )
+
+        self.df = df
+
+        #One row per (exercise, muscle) pair, index values still point at the original row
+        muscles = df["muscle_list"].explode().dropna()
+
+        #Inverted indexes mapping a normalised value to the rows that have it
+        self.by_muscle = _build_index(muscles)
+
+        #Composite (muscle, mechanics) buckets used by the workout generator to split compounds from isolations
+        self.by_muscle_mechanics = _build_index(pd.DataFrame({
+            "muscle": muscles,
+            "mechanics": df["mechanics_norm"].loc[muscles.index]
+        }))
+        self.by_mechanics = _build_index(df["mechanics_norm"])
+        self.by_equipment = _build_index(df["equipment_norm"])
+        self.by_classification = _build_index(df["classification_norm"])
+
+        #Row-ID sets used for intersections by the refresh lookup
+        self._muscle_sets = {key: frozenset(rows.tolist()) for key, rows in self.by_muscle.items()}
+        self._mechanics_sets = {key: frozenset(rows.tolist()) for key, rows in self.by_mechanics.items()}
+        self._equipment_sets = {key: frozenset(rows.tolist()) for key, rows in self.by_equipment.items()}
+        self._bodybuilding_set = frozenset(self.rows_for(self.by_classification, "bodybuilding").tolist())
+
+        #Every row pre-serialised in the format used by workout plans
+        self._records = [
+            {
+                "exercise_name": name,
+                "target_muscle": muscle,
+                "equipment": equipment,
+                "mechanics": mechanics
+            }
+            for name, muscle, equipment, mechanics in zip(
+                df["Exercise"], df["Target Muscle Group"], df["Primary Equipment"], df["Mechanics"]
+            )
+        ]
+
+        #Memoised lookups keyed by (muscle, mechanics, equipment set)
+        self._candidate_cache = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    #Returns the row positions for a key in one of the indexes, or an empty array
+    @staticmethod
+    def rows_for(index, key):
+        return index.get(key, np.empty(0, dtype=np.int64))
+
+    #Returns row IDs of bodybuilding exercises for a target muscle, mechanics and set of allowed equipment
+    #The candidate set is resolved by intersecting index sets and memoised, so repeat lookups are a dict hit
+    def candidates(self, muscle, mechanics, equipment):
+        key = (muscle, mechanics, frozenset(equipment))
+        rows = self._candidate_cache.get(key)
+        if rows is not None:
+            return rows
+
+        allowed_equipment = frozenset().union(*(self._equipment_sets.get(eq, frozenset()) for eq in key[2]))
+        matches = self._bodybuilding_set & self._mechanics_sets.get(mechanics, frozenset()) & allowed_equipment
+
+        #An empty muscle matches every muscle
+        if muscle:
+            matches &= self._muscle_sets.get(muscle, frozenset())
+
+        rows = tuple(sorted(matches))
+
+        #Keeps the cache bounded if clients send many different equipment combinations
+        if len(self._candidate_cache) >= CANDIDATE_CACHE_SIZE:
+            self._candidate_cache.clear()
+        self._candidate_cache[key] = rows
+        return rows
+
+    #Serialises a single row in the format used by workout plans
+    def exercise_dict(self, row_id):
+        return dict(self._records[row_id])
+
+    #Serialises several rows, copies are returned so callers can't modify the cached records
+    def exercise_dicts(self, row_ids):
+        return [dict(self._records[row_id]) for row_id in row_ids]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+#Returns the shared catalog, only reloading the CSV when the file has been modified
+def get_exercise_catalog():
+    global _catalog
+    catalog = _catalog
+    try:
+        mtime = os.path.getmtime(EXERCISE_CSV)
+    except OSError:
+        mtime = None
+
+    if catalog is not None and (mtime is None or mtime == catalog.mtime):
+        return catalog
+
+    with _catalog_lock:
+        #Another thread may have already reloaded while this one was waiting
+        if _catalog is None or (mtime is not None and mtime != _catalog.mtime):
+            _catalog = ExerciseCatalog()
+        return _catalog
@@ -0,0 +1,358 @@
+import csv
+import hashlib
+import os
+import re
+import tempfile
+import numpy as np
+
+#Food catalog used by the meal solver
+#The food CSVs are merged into one typed table, saved as a .npy snapshot that later processes memory-map
+#instead of parsing the CSVs again, and foods are tagged with the dietary attributes each preference rules out
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+#Snapshots are a build cache, written to backend/.cache/food_catalog unless FOOD_CATALOG_DIR is set
+SNAPSHOT_DIR = os.environ.get(
+    "FOOD_CATALOG_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(base_dir)), ".cache", "food_catalog"),
+)
+
+#Bumped whenever FOOD_DTYPE or how sources are merged changes, so old snapshots are rebuilt
+SNAPSHOT_FORMAT = 2
+
+#Nutrients per serving, in the order the solver takes targets
+NUTRIENTS = ["calories", "protein", "carbs", "fat", "fiber"]
+
+FOOD_DTYPE = np.dtype([
+    ("name", "U64"),
+    ("category", "U32"),
+    ("serving_unit", "U64"),
+    ("serving_quantity", "f8"),
+    ("serving_weight", "f8"),
+    ("nutrients", "f8", (len(NUTRIENTS),)),
+    ("fiber_estimated", "?"),
+])
+
+_FIBER_COLUMNS = {
+    "name": "Food Name",
+    "category": "Category",
+    "serving_unit": "Serving Unit",
+    "serving_quantity": "Serving Quantity",
+    "serving_weight": "Serving Weight (g)",
+    "calories": "Calories per Serving",
+    "protein": "Protein per Serving",
+    "carbs": "Carbs per Serving",
+    "fat": "Fat per Serving",
+    "fiber": "Fiber per Serving",
+}
+
+#Source CSVs and the column holding each field, in priority order
+#A food listed by more than one source is taken from the first
+#Every source needs a column for each nutrient except fiber, which is estimated when a source has none
+SOURCES = [
+    ("food_data_with_fiber_new.csv", _FIBER_COLUMNS),
+    ("food_data_with_fiber.csv", _FIBER_COLUMNS),
+    ("food_nutrition_data.csv", {
+        "name": "Food Name",
+        "category": "Category",
+        "serving_unit": "Unit",
+        "serving_quantity": "Serving Size",
+        "serving_weight": "Serving Weight (g)",
+        "calories": "Calories",
+        "protein": "Protein (g)",
+        "carbs": "Carbs (g)",
+        "fat": "Fat (g)",
+    }),
+]
+
+#Categories of food_nutrition_data.csv renamed to the ones used by the other sources
+CATEGORY_NAMES = {
+    "protein sources": "Protein",
+    "carbohydrate sources": "Carb",
+    "healthy fats": "Fat",
+    "vegetables": "Vegetable",
+    "fruits": "Fruit",
+    "legumes & beans": "Legume",
+    "unknown": "",
+}
+
+#Typical grams of fiber per gram of carbs by category, used to estimate fiber for sources without it
+#Animal foods have none, legumes and vegetables get a large share of their carbs from fiber
+FIBER_PER_GRAM_OF_CARBS = {
+    "Protein": 0.0,
+    "Dairy": 0.0,
+    "Carb": 0.09,
+    "Fruit": 0.15,
+    "Fat": 0.3,
+    "Vegetable": 0.35,
+    "Legume": 0.35,
+}
+DEFAULT_FIBER_PER_GRAM_OF_CARBS = 0.14
+
+#Words (singular, lowercase) that give a food each tag, plurals ending in s or es also match
+TAG_KEYWORDS = {
+    "meat": ["chicken", "turkey", "beef", "lamb", "pork", "steak", "mince", "sausage", "bacon", "ham"],
+    "fish": ["salmon", "tuna", "cod", "tilapia", "shrimp", "prawn", "fish", "sardine", "mackerel"],
+    "egg": ["egg"],
+    "dairy": [
+        "milk", "cheese", "yogurt", "yoghurt", "cream", "butter", "parmesan", "mozzarella",
+        "cheddar", "ricotta", "feta", "gouda", "provolone",
+    ],
+    "gluten": ["wheat", "bread", "pasta", "noodle", "couscous", "bulgar", "bulgur", "pita", "tortilla", "oat", "barley", "rye"],
+    "grain": [
+        "rice", "wheat", "bread", "pasta", "noodle", "couscous", "bulgar", "bulgur", "pita", "tortilla",
+        "oat", "barley", "rye", "quinoa", "corn", "sweetcorn",
+    ],
+    "legume": ["bean", "pea", "chickpea", "lentil", "tofu", "soy", "soybean", "edamame", "peanut"],
+}
+
+#Tags given by a food's category on top of its name
+CATEGORY_TAGS = {
+    "Dairy": {"dairy"},
+    "Legume": {"legume"},
+}
+
+#Tags for foods whose names would otherwise be mis-tagged, keyed by lowercase name
+TAG_OVERRIDES = {
+    "peanut butter": {"legume"},
+    "cocoa butter": set(),
+    "coconut milk": set(),
+    "almond milk": set(),
+    "oat milk": {"gluten", "grain"},
+    "soy milk": {"legume"},
+}
+
+#Tags each preference rules out
+EXCLUDED_TAGS = {
+    "any": set(),
+    "vegetarian": {"meat", "fish"},
+    "vegan": {"meat", "fish", "egg", "dairy"},
+    "pescatarian": {"meat"},
+    "ketogenic": set(),
+    "paleo": {"grain", "legume", "dairy"},
+    "gluten_free": {"gluten"},
+    "dairy_free": {"dairy"},
+    "low_carb": set(),
+}
+
+#Carb restricted preferences only allow foods with at most this many grams of net carbs (carbs - fiber) per 100 g
+MAX_NET_CARBS_PER_100G = {
+    "ketogenic": 6,
+    "low_carb": 15,
+}
+
+#Every preference with its own food table, matches ClientProfile.DIETARY_PREFERENCES
+PREFERENCES = list(EXCLUDED_TAGS)
+
+
+def _words(name):
+    return re.findall(r"[a-z]+", name.lower())
+
+
+#Dietary tags of one food
+def dietary_tags(name, category=""):
+    key = " ".join(_words(name))
+    if key in TAG_OVERRIDES:
+        return set(TAG_OVERRIDES[key])
+
+    words = set(_words(name))
+    tags = {
+        tag for tag, keywords in TAG_KEYWORDS.items()
+        if any(keyword in words or keyword + "s" in words or keyword + "es" in words for keyword in keywords)
+    }
+    return tags | CATEGORY_TAGS.get(category, set())
+
+
+#Food table loaded from a snapshot or the source CSVs
+#records is a FOOD_DTYPE array, which may be memory-mapped, and version is the source_hash it was built from
+#so cached solutions from another table are never reused
+#Subsets share records and only keep the indexes of their rows, fields are read for those rows on access
+class FoodCatalog:
+    def __init__(self, records, version, rows=None):
+        self.records = records
+        self.version = version
+        self.rows = np.arange(len(records)) if rows is None else rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def names(self):
+        return self.records["name"][self.rows].tolist()
+
+    @property
+    def categories(self):
+        return self.records["category"][self.rows].tolist()
+
+    #One row per food, one column per nutrient
+    @property
+    def nutrients(self):
+        return self.records["nutrients"][self.rows]
+
+    @property
+    def serving_weights(self):
+        return self.records["serving_weight"][self.rows]
+
+    #True for foods whose fiber was estimated from their carbs because their source had no fiber column
+    @property
+    def fiber_estimated(self):
+        return self.records["fiber_estimated"][self.rows]
+
+    def subset(self, mask):
+        return FoodCatalog(self.records, self.version, self.rows[mask])
+
+    #Foods with every nutrient a finite number, the solver needs all of them
+    #Sources must have every nutrient but fiber and fiber is estimated, so this only guards against bad snapshots
+    def complete(self):
+        return self.subset(np.isfinite(self.nutrients).all(axis=1))
+
+    #One boolean column per tag, in TAG_KEYWORDS order
+    def tags(self):
+        food_tags = [dietary_tags(name, category) for name, category in zip(self.names, self.categories)]
+        return np.array([[tag in tags for tag in TAG_KEYWORDS] for tags in food_tags], dtype=bool).reshape(len(self), len(TAG_KEYWORDS))
+
+    #Boolean mask of the foods a preference allows, unknown preferences allow every food
+    def eligible(self, preference, tags=None):
+        tags = tags if tags is not None else self.tags()
+        excluded = [i for i, tag in enumerate(TAG_KEYWORDS) if tag in EXCLUDED_TAGS.get(preference, set())]
+        eligible = ~tags[:, excluded].any(axis=1)
+
+        max_net_carbs = MAX_NET_CARBS_PER_100G.get(preference)
+        if max_net_carbs is not None:
+            nutrients = self.nutrients
+            net_carbs = nutrients[:, NUTRIENTS.index("carbs")] - nutrients[:, NUTRIENTS.index("fiber")]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                per_100g = net_carbs / self.serving_weights * 100
+            eligible &= np.nan_to_num(per_100g, nan=np.inf) <= max_net_carbs
+
+        return eligible
+
+    #One catalog per preference, tags are worked out once and shared
+    def by_preference(self):
+        tags = self.tags()
+        return {preference: self.subset(self.eligible(preference, tags)) for preference in PREFERENCES}
+
+
+#Estimated grams of fiber in a serving with the given carbs
+def estimate_fiber(category, carbs):
+    return round(carbs * FIBER_PER_GRAM_OF_CARBS.get(category, DEFAULT_FIBER_PER_GRAM_OF_CARBS), 1)
+
+
+def _number(row, column, path, line, field):
+    try:
+        value = float(row[column])
+    except (TypeError, ValueError):
+        raise ValueError(f"{path}:{line} has an invalid {field}: {row[column]!r}")
+    if not np.isfinite(value) or value < 0:
+        raise ValueError(f"{path}:{line} has an invalid {field}: {row[column]!r}")
+    return value
+
+
+#Reads and validates one source CSV, returns a list of record tuples
+def _read_source(path, columns):
+    missing_nutrients = [nutrient for nutrient in NUTRIENTS if nutrient != "fiber" and nutrient not in columns]
+    if missing_nutrients:
+        raise ValueError(f"{path} has no column for {missing_nutrients}, the meal solver needs every nutrient")
+    fiber_estimated = "fiber" not in columns
+
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        header = [column.strip() for column in reader.fieldnames or []]
+        missing = [column for column in columns.values() if column not in header]
+        if missing:
+            #If CSV has wrong structure, raise error
+            raise ValueError(f"Missing columns in {path}: {missing}. Found: {header}")
+        reader.fieldnames = header
+
+        rows = []
+        for line, row in enumerate(reader, start=2):
+            name = " ".join(row[columns["name"]].split()).lower()
+            if not name:
+                raise ValueError(f"{path}:{line} has no food name")
+
+            category = row[columns["category"]].strip()
+            category = CATEGORY_NAMES.get(category.lower(), category)
+            unit = row[columns["serving_unit"]].strip()
+            for field, value in (("name", name), ("category", category), ("serving_unit", unit)):
+                if len(value) > FOOD_DTYPE[field].itemsize // 4:
+                    raise ValueError(f"{path}:{line} has a {field} longer than the catalog allows: {value!r}")
+
+            serving_weight = _number(row, columns["serving_weight"], path, line, "serving weight")
+            if serving_weight == 0:
+                raise ValueError(f"{path}:{line} has a serving weight of 0")
+
+            nutrients = {
+                nutrient: _number(row, columns[nutrient], path, line, nutrient)
+                for nutrient in NUTRIENTS if nutrient in columns
+            }
+            if fiber_estimated:
+                nutrients["fiber"] = estimate_fiber(category, nutrients["carbs"])
+
+            rows.append((
+                name,
+                category,
+                unit,
+                _number(row, columns["serving_quantity"], path, line, "serving quantity"),
+                serving_weight,
+                [nutrients[nutrient] for nutrient in NUTRIENTS],
+                fiber_estimated,
+            ))
+        return rows
+
+
+#Merges the source CSVs into one FOOD_DTYPE array, foods are matched by lowercase name
+def build_records(directory=base_dir, sources=SOURCES):
+    merged = {}
+    for file_name, columns in sources:
+        for row in _read_source(os.path.join(directory, file_name), columns):
+            merged.setdefault(row[0], row)
+    return np.array(list(merged.values()), dtype=FOOD_DTYPE)
+
+
+#Hash of the source CSVs and snapshot format, names the snapshot built from them
+def source_hash(directory=base_dir, sources=SOURCES):
+    digest = hashlib.sha1(str(SNAPSHOT_FORMAT).encode())
+    for file_name, _ in sources:
+        with open(os.path.join(directory, file_name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def snapshot_path(digest, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f"food_catalog_{digest}.npy")
+
+
+#Writes the snapshot atomically and removes snapshots of older sources
+def write_snapshot(records, path):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".npy.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, records, allow_pickle=False)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    for file_name in os.listdir(directory):
+        if file_name.startswith("food_catalog_") and file_name.endswith(".npy") and file_name != os.path.basename(path):
+            os.unlink(os.path.join(directory, file_name))
+
+
+#Loads the catalog, memory-mapping the snapshot for the current CSVs or building it if there isn't one
+#If the snapshot can't be written the catalog is still returned, it is just rebuilt by the next process
+def load_food_catalog(directory=base_dir, snapshot_dir=SNAPSHOT_DIR):
+    version = source_hash(directory)
+    path = snapshot_path(version, snapshot_dir)
+    try:
+        return FoodCatalog(np.load(path, mmap_mode="r", allow_pickle=False), version)
+    except FileNotFoundError:
+        pass
+
+    records = build_records(directory)
+    try:
+        write_snapshot(records, path)
+    except OSError:
+        pass
+    return FoodCatalog(records, version)
@@ -1,107 +1,380 @@
+import threading
 import numpy as np
+import pandas as pd
+from collections import defaultdict
+from datetime import date
 from sklearn.neighbors import NearestNeighbors
-from django.db.models import Avg
-from users.models import ClientProfile, WorkoutPlanRating, WorkoutPlan
-
-#Function that encodes client as a feature vector to compare similarity to other clients
-def encode_client_features(client):
-    #Takes categorical features and numerically encodes them
-    activity_map = {
-        "sedentary": 1,
-        "lightly_active": 2,
-        "moderately_active": 3,
-        "very_active": 4,
-        "super_active": 5
-    }
-    gender_map = {"male": 0, "female": 1, "other": 2}
-    goal_map = {"lose_weight": 0, "maintain_weight": 1, "gain_muscle": 2}
-
-    #Returns the feature map for the client passed to the function
-    return [
-        client.age or 0,
-        client.height or 0,
-        client.weight or 0,
-        activity_map.get(client.activity_level, 3),
-        gender_map.get(client.gender, 2),
-        goal_map.get(client.goal, 1)
-    ]
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import now
+from users.models import ClientProfile, WorkoutPlanRating, WorkoutPlan, RecommendedWorkout
 
-#Function to return workouts from similar clients, relative totarget client
-def get_top_recommended_workouts_for_client(target_client, k=5):
-    all_clients = ClientProfile.objects.filter(workout_ratings__isnull=False).distinct()
-
-    #If there are less than 2 clients, not enough data so return nothing
-    if len(all_clients) < 2:
-        return []  
-    
-    #Array for storing each client's feature vector
-    features = []
-
-    #Array for storing each feature vector's corresponding client ID
-    index_to_client = []
-
-    #Dictionary where keys will be Client IDs, values will be list of their top rated workouts
-    plan_ids_by_client = {}
-
-    #For each client, does the following:
-    #1. Encodes them as a feature vector
-    #2. Appends their feature vector to features array
-    #3. Appends client's ID to another corresponding array, indexes match for both arrays
-    for client in all_clients:
-        vector = encode_client_features(client)
-        features.append(vector)
-        index_to_client.append(client.id)
-
-        #For each client, gets every workout they've rated
-        #Sorts them in descending rating order (so top rated workouts are first)
-        top_plans = (
-            WorkoutPlanRating.objects
-            .filter(client=client)
-            .order_by('-rating')
-            .values_list('workout_plan_id', flat=True)
+#Fields of ClientProfile needed to encode a client, loaded with .values() to keep queries small
+FEATURE_FIELDS = ["id", "date_of_birth", "height", "weight", "activity_level", "gender", "goal"]
+
+#Categorical features and their encodings
+ACTIVITY_LEVELS = {
+    "sedentary": 1,
+    "lightly_active": 2,
+    "moderately_active": 3,
+    "very_active": 4,
+    "super_active": 5
+}
+GENDERS = ["male", "female", "other"]
+GOALS = ["lose_weight", "maintain_weight", "gain_muscle"]
+
+#Numeric features are standardised, gender and goal are one-hot encoded
+NUMERIC_FEATURES = ["age", "height", "weight", "activity_level"]
+
+#Each feature's weight multiplies its squared difference in the distance between two clients
+#Goal counts double as clients with the same goal tend to rate the same kind of plans highly
+#Can be overridden with RECOMMENDER_FEATURE_WEIGHTS in settings
+DEFAULT_FEATURE_WEIGHTS = {
+    "age": 1.0,
+    "height": 1.0,
+    "weight": 1.0,
+    "activity_level": 1.0,
+    "gender": 1.0,
+    "goal": 2.0
+}
+
+
+#Reads the encoded fields from a ClientProfile or a row from .values(*FEATURE_FIELDS)
+def _as_row(client):
+    if isinstance(client, dict):
+        return client
+    return {field: getattr(client, field) for field in FEATURE_FIELDS}
+
+
+#Encodes clients as feature vectors to compare similarity to other clients
+#Works on the whole client table at once, the standardisation is fitted once and stored
+class ClientFeatureEncoder:
+    def __init__(self, weights=None, standardise=True):
+        self.weights = {
+            **DEFAULT_FEATURE_WEIGHTS,
+            **getattr(settings, "RECOMMENDER_FEATURE_WEIGHTS", {}),
+            **(weights or {})
+        }
+        self.standardise = standardise
+
+        #Column layout: numeric features then one column per gender and per goal
+        self.columns = (
+            NUMERIC_FEATURES
+            + [f"gender_{gender}" for gender in GENDERS]
+            + [f"goal_{goal}" for goal in GOALS]
         )
+        feature_of_column = NUMERIC_FEATURES + ["gender"] * len(GENDERS) + ["goal"] * len(GOALS)
+        self.column_weights = np.sqrt([self.weights[feature] for feature in feature_of_column])
 
-        #Populates dictionary of clientID: [top rated workout] pairs
-        plan_ids_by_client[client.id] = list(top_plans)
+        #Identity scaling until fit() is called
+        self.mean = np.zeros(len(NUMERIC_FEATURES))
+        self.scale = np.ones(len(NUMERIC_FEATURES))
 
-    #Sets up KNN model to find K nearest neighbours to the target
-    #len(features) - 1 ensures that if there's less than k values, avoids requesting more neighbours than available
-    knn = NearestNeighbors(n_neighbors=min(k, len(features) - 1), metric='euclidean')
+    #Returns the unscaled matrix with one row per client
+    def raw_matrix(self, clients):
+        frame = pd.DataFrame.from_records([_as_row(client) for client in clients], columns=FEATURE_FIELDS)
+        matrix = np.zeros((len(frame), len(self.columns)))
+        if frame.empty:
+            return matrix
 
-    #Converts list of features into a matrix
-    #Each row corresponds to a client, each column corresponds to a specific feature
-    knn.fit(np.array(features))
+        #Age in whole years, 1 is subtracted if the birthday hasn't occurred yet this year
+        today = date.today()
+        dob = pd.to_datetime(frame["date_of_birth"])
+        birthday_pending = (dob.dt.month > today.month) | ((dob.dt.month == today.month) & (dob.dt.day > today.day))
+        matrix[:, 0] = (today.year - dob.dt.year - birthday_pending).fillna(0).to_numpy()
 
-    #Takes target client, encodes them into feature vector, reshapes into 2d array with 1 row
-    target_vector = np.array(encode_client_features(target_client)).reshape(1, -1)
+        matrix[:, 1] = pd.to_numeric(frame["height"]).fillna(0).to_numpy()
+        matrix[:, 2] = pd.to_numeric(frame["weight"]).fillna(0).to_numpy()
+        matrix[:, 3] = frame["activity_level"].map(ACTIVITY_LEVELS).fillna(3).to_numpy()
 
-    #Indices stores the row numbers of the nearest neighbours in the 2d features array
-    #Distances aren't needed
-    distances, indices = knn.kneighbors(target_vector)
+        #Genders are stored in mixed case, unknown values count as other
+        gender = frame["gender"].fillna("").str.lower()
+        gender = gender.where(gender.isin(GENDERS), "other")
+        goal = frame["goal"].where(frame["goal"].isin(GOALS), "maintain_weight")
 
-    #Holds IDs of all workout plans recommended to target
-    recommended_plan_ids = []
+        offset = len(NUMERIC_FEATURES)
+        for i, value in enumerate(GENDERS):
+            matrix[:, offset + i] = (gender == value).to_numpy()
+        offset += len(GENDERS)
+        for i, value in enumerate(GOALS):
+            matrix[:, offset + i] = (goal == value).to_numpy()
 
-    #Indices is a 2d array, so to access the first/only row have to access index 0
-    for neighbour_client_index in indices[0]:
-        #Gets id of neighbour client
-        neighbor_client_id = index_to_client[neighbour_client_index]
+        return matrix
 
-        #.extend() used instead of append so that individual plan ids are added, rather than arrays of plan ids
-        recommended_plan_ids.extend(plan_ids_by_client[neighbor_client_id])
+    #Fits the standardisation of the numeric columns
+    def fit(self, raw):
+        if self.standardise and len(raw):
+            numeric = raw[:, :len(NUMERIC_FEATURES)]
+            self.mean = numeric.mean(axis=0)
+            self.scale = numeric.std(axis=0)
+            #Constant columns are left unscaled rather than divided by zero
+            self.scale[self.scale == 0] = 1.0
+        return self
 
+    #Applies the stored standardisation and the feature weights
+    def transform(self, raw):
+        encoded = np.array(raw, dtype=float, copy=True)
+        encoded[:, :len(NUMERIC_FEATURES)] = (encoded[:, :len(NUMERIC_FEATURES)] - self.mean) / self.scale
+        return encoded * self.column_weights
 
-    #Remove duplicates and workouts already rated by the target user
-    already_rated = set(
-        WorkoutPlanRating.objects.filter(client=target_client).values_list("workout_plan_id", flat=True)
-    )
+    def encode(self, clients):
+        return self.transform(self.raw_matrix(clients))
+
+
+#Long lived index of every client that has rated a workout
+#Stores each client's unscaled features and their rated plans in descending rating order
+#Kept up to date incrementally by the signals in users/signals.py rather than rebuilt per request
+class RecommenderIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    #Drops everything, the next query rebuilds from the database
+    def reset(self):
+        with self.lock:
+            self.built_on = None
+            self.encoder = ClientFeatureEncoder()
+            self.features = np.empty((0, len(self.encoder.columns)))
+            self.size = 0
+            self.client_ids = []
+            self.row_by_client = {}
+            self.plan_ids_by_client = {}
+            self._knn = None
+
+    #Loads the whole index in two queries, one for ratings and one for the rated clients
+    def build(self):
+        with self.lock:
+            plan_ids_by_client = defaultdict(list)
+            ratings = (
+                WorkoutPlanRating.objects
+                .order_by("client_id", "-rating", "id")
+                .values_list("client_id", "workout_plan_id")
+            )
+            for client_id, plan_id in ratings:
+                plan_ids_by_client[client_id].append(plan_id)
+
+            clients = list(
+                ClientProfile.objects
+                .filter(workout_ratings__isnull=False)
+                .distinct()
+                .order_by("id")
+                .values(*FEATURE_FIELDS)
+            )
+
+            self.reset()
+
+            #The whole rated population is encoded in one go and the scaling fitted on it
+            raw = self.encoder.raw_matrix(clients)
+            self.encoder.fit(raw)
+            self.features = raw
+            self.size = len(raw)
+            self.client_ids = [client["id"] for client in clients]
+            self.row_by_client = {client_id: row for row, client_id in enumerate(self.client_ids)}
+            self.plan_ids_by_client = {client_id: plan_ids_by_client.get(client_id, []) for client_id in self.client_ids}
+
+            #Ages are part of the features, so the index is rebuilt once a day
+            self.built_on = date.today()
+
+    def is_built(self):
+        return self.built_on == date.today()
+
+    #Adds or overwrites a client's feature row, the matrix grows by doubling so appends are amortised O(1)
+    def _set_row(self, client_id, vector):
+        row = self.row_by_client.get(client_id)
+        if row is None:
+            if self.size == len(self.features):
+                grown = np.zeros((max(16, 2 * len(self.features)), self.features.shape[1]))
+                grown[:self.size] = self.features[:self.size]
+                self.features = grown
+            row = self.size
+            self.size += 1
+            self.row_by_client[client_id] = row
+            self.client_ids.append(client_id)
+        self.features[row] = vector
+        self._knn = None
+
+    #Removes a client by moving the last row into its slot
+    def _remove_row(self, client_id):
+        row = self.row_by_client.pop(client_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved_client = self.client_ids[last]
+            self.features[row] = self.features[last]
+            self.client_ids[row] = moved_client
+            self.row_by_client[moved_client] = row
+        self.client_ids.pop()
+        self.size -= 1
+        self.plan_ids_by_client.pop(client_id, None)
+        self._knn = None
+
+    #Called after a ClientProfile is saved, re-encodes the client if they are in the index
+    def update_client(self, client):
+        with self.lock:
+            if self.is_built() and client.id in self.row_by_client:
+                self._set_row(client.id, self.encoder.raw_matrix([client])[0])
+
+    #Called after a client's ratings change, reloads that client's rated plans
+    def update_client_ratings(self, client_id):
+        with self.lock:
+            if not self.is_built():
+                return
+
+            plan_ids = list(
+                WorkoutPlanRating.objects
+                .filter(client_id=client_id)
+                .order_by("-rating", "id")
+                .values_list("workout_plan_id", flat=True)
+            )
+
+            if not plan_ids:
+                self._remove_row(client_id)
+                return
+
+            if client_id not in self.row_by_client:
+                client = ClientProfile.objects.filter(id=client_id).values(*FEATURE_FIELDS).first()
+                if client is None:
+                    return
+                self._set_row(client_id, self.encoder.raw_matrix([client])[0])
+            self.plan_ids_by_client[client_id] = plan_ids
+
+    #Returns the IDs of the k clients closest to the target, excluding the target themselves
+    def nearest_client_ids(self, target_client, k):
+        return self.nearest_client_ids_bulk([target_client.id], self.encoder.raw_matrix([target_client]), k)[0]
+
+    #Same as nearest_client_ids for many clients at once, using a single kneighbors call
+    #raw holds one unscaled row per client, as returned by encoder.raw_matrix()
+    def nearest_client_ids_bulk(self, client_ids, raw, k):
+        with self.lock:
+            if not self.is_built():
+                self.build()
+
+            #One extra neighbour is requested in case a client finds themselves
+            n_neighbors = min(k + 1, self.size)
+            if n_neighbors < 1 or not client_ids:
+                return [[] for _ in client_ids]
+
+            #Brute force search only stores the matrix on fit, so refitting after an update is cheap
+            #Scaling and weights are applied to the stored matrix, so plain euclidean distance is weighted
+            if self._knn is None:
+                self._knn = NearestNeighbors(metric='euclidean', algorithm='brute')
+                self._knn.fit(self.encoder.transform(self.features[:self.size]))
+
+            distances, indices = self._knn.kneighbors(self.encoder.transform(raw), n_neighbors=n_neighbors)
+
+            results = []
+            for client_id, neighbour_rows in zip(client_ids, indices):
+                neighbour_ids = [self.client_ids[i] for i in neighbour_rows if self.client_ids[i] != client_id]
+                results.append(neighbour_ids[:k])
+            return results
+
+    #Returns a copy of a client's rated plans
+    def plan_ids_for(self, client_id):
+        with self.lock:
+            return list(self.plan_ids_by_client.get(client_id, []))
+
+
+recommender_index = RecommenderIndex()
+
+
+#Turns neighbours into plan IDs, closest neighbour first and each neighbour's top rated plans first
+#plan_ids_by_client maps clients to their rated plans, best rated first
+#Removes duplicates and workouts the client has already rated
+def _recommended_plan_ids(client_id, neighbour_ids, plan_ids_by_client, limit):
+    already_rated = set(plan_ids_by_client.get(client_id, []))
 
     final_plan_ids = []
-    #Loops through and adds plan ids to final_plan_ids array
-    for plan_id in recommended_plan_ids:
-        if plan_id not in already_rated and plan_id not in final_plan_ids:
-            final_plan_ids.append(plan_id)
+    for neighbour_id in neighbour_ids:
+        for plan_id in plan_ids_by_client.get(neighbour_id, []):
+            if plan_id not in already_rated and plan_id not in final_plan_ids:
+                final_plan_ids.append(plan_id)
+    return final_plan_ids[:limit]
+
+
+#Rated plans of each client, best rated first, read from the database in one query
+#The index's copy is only updated in the process that saved a rating, so live requests read them here
+def _rated_plan_ids(client_ids):
+    plan_ids_by_client = defaultdict(list)
+    ratings = (
+        WorkoutPlanRating.objects
+        .filter(client_id__in=client_ids)
+        .order_by("client_id", "-rating", "id")
+        .values_list("client_id", "workout_plan_id")
+    )
+    for client_id, plan_id in ratings:
+        plan_ids_by_client[client_id].append(plan_id)
+    return plan_ids_by_client
+
+
+#Function to return workouts from similar clients, relative totarget client
+def get_top_recommended_workouts_for_client(target_client, k=5):
+    with recommender_index.lock:
+        if not recommender_index.is_built():
+            recommender_index.build()
+
+        #If there are less than 2 clients, not enough data so return nothing
+        if recommender_index.size < 2:
+            return WorkoutPlan.objects.none()
+
+        #Single kneighbors call against the persistent index
+        neighbour_ids = recommender_index.nearest_client_ids(target_client, k)
+
+    #Ratings of the target and their neighbours come from the database, so ratings saved by other processes count
+    plan_ids_by_client = _rated_plan_ids([target_client.id, *neighbour_ids])
+    final_plan_ids = _recommended_plan_ids(target_client.id, neighbour_ids, plan_ids_by_client, 5)
 
     #Return top 5 recommendations
     #Filters WorkoutPlan where the ids match the final plan ids
-    return WorkoutPlan.objects.filter(id__in=final_plan_ids[:5])  
+    return WorkoutPlan.objects.filter(id__in=final_plan_ids)
+
+
+#Computes recommendations for every client with one vectorised kneighbors query
+#Replaces the RecommendedWorkout table and returns (clients processed, recommendations written)
+def precompute_recommendations(k=5, limit=5, batch_size=1000):
+    with recommender_index.lock:
+        #Always starts from a fresh index so the table reflects the current database
+        recommender_index.build()
+
+        clients = list(ClientProfile.objects.order_by("id").values(*FEATURE_FIELDS))
+        client_ids = [client["id"] for client in clients]
+
+        rows = []
+        computed_at = now()
+        if recommender_index.size >= 2:
+            raw = recommender_index.encoder.raw_matrix(clients)
+            neighbours = recommender_index.nearest_client_ids_bulk(client_ids, raw, k)
+            for client_id, neighbour_ids in zip(client_ids, neighbours):
+                #The index was just built from the database, so its ratings are current
+                plan_ids = _recommended_plan_ids(client_id, neighbour_ids, recommender_index.plan_ids_by_client, limit)
+                for rank, plan_id in enumerate(plan_ids, start=1):
+                    rows.append(RecommendedWorkout(
+                        client_id=client_id, workout_plan_id=plan_id, rank=rank, computed_at=computed_at
+                    ))
+
+    #Swaps the whole table in one transaction so readers never see a partial set
+    with transaction.atomic():
+        RecommendedWorkout.objects.all().delete()
+        RecommendedWorkout.objects.bulk_create(rows, batch_size=batch_size)
+
+    return len(clients), len(rows)
+
+
+#Reads a client's precomputed recommendations, returns None if none have been computed for them
+#Plans the client has rated since the last precompute are skipped
+def get_precomputed_recommendations(client):
+    precomputed = list(
+        RecommendedWorkout.objects
+        .filter(client=client)
+        .annotate(already_rated=Exists(
+            WorkoutPlanRating.objects.filter(client=client, workout_plan=OuterRef("workout_plan"))
+        ))
+        .order_by("rank")
+        .values_list("workout_plan_id", "already_rated")
+    )
+    if not precomputed:
+        return None
+
+    plan_ids = [plan_id for plan_id, already_rated in precomputed if not already_rated]
+    return WorkoutPlan.objects.filter(id__in=plan_ids)
@@ -0,0 +1,113 @@
+import numpy as np
+from datetime import date
+from django.db import transaction
+from django.utils.timezone import now
+from users.models import (
+    ClientProfile, ACTIVITY_MULTIPLIERS, DEFAULT_ACTIVITY_MULTIPLIER, GOAL_CALORIE_ADJUSTMENTS, MACRO_FIELDS
+)
+
+#Vectorised version of ClientProfile.calculate_macronutrients for recomputing targets in bulk
+#Follows the same formula and rounding, but evaluates a whole chunk of profiles per NumPy operation
+
+#ClientProfile columns loaded to recompute targets
+INPUT_COLUMNS = ["id", "date_of_birth", "gender", "height", "weight", "activity_level", "goal", "protein_multiplier"]
+
+#Targets in the order they are returned by calculate_macros
+TARGET_COLUMNS = ["daily_calories", "daily_carbs", "daily_protein", "daily_fat", "daily_fiber"]
+
+#Ages in whole years on the given day for an array of datetime64[D] birth dates
+def ages(dates_of_birth, today=None):
+    today = today or date.today()
+    years = dates_of_birth.astype("datetime64[Y]").astype(int) + 1970
+    month_starts = dates_of_birth.astype("datetime64[M]")
+    months = month_starts.astype(int) % 12 + 1
+    days = (dates_of_birth - month_starts).astype(int) + 1
+
+    #Subtracts 1 where the birthday hasn't occurred yet this year
+    before_birthday = (months > today.month) | ((months == today.month) & (days > today.day))
+    return today.year - years - before_birthday
+
+
+#Rounds each element with Python's round(), as calculate_macronutrients does
+#np.round scales by 10**digits before rounding, so it can differ from round() in the last decimal place
+def round_like_model(values, digits=None):
+    return np.array([round(value, digits) for value in values.tolist()])
+
+
+#Daily targets for arrays of profile fields, returns a dict of arrays keyed by TARGET_COLUMNS
+def calculate_macros(age, gender, height, weight, activity_level, goal, protein_multiplier):
+    #Basal Metabolic Rate (BMR) calculation using Mifflin-St Jeor Equation
+    bmr = 10 * weight + 6.25 * height - 5 * age + np.where(gender == "male", 5, -161)
+
+    #Categorical fields are mapped through the same tables the model uses
+    activity_multiplier = np.array(
+        [ACTIVITY_MULTIPLIERS.get(level, DEFAULT_ACTIVITY_MULTIPLIER) for level in activity_level], dtype=float
+    )
+    adjustment = np.array([GOAL_CALORIE_ADJUSTMENTS.get(g, 0) for g in goal], dtype=float)
+
+    daily_calories = bmr * activity_multiplier + adjustment
+    daily_protein = weight * protein_multiplier
+    daily_fat = daily_calories * 0.25 / 9
+    daily_carbs = (daily_calories - (daily_protein * 4 + daily_fat * 9)) / 4
+    daily_fiber = daily_calories * 14 / 1000
+
+    return {
+        "daily_calories": round_like_model(daily_calories).astype(int),
+        "daily_carbs": round_like_model(daily_carbs, 2),
+        "daily_protein": round_like_model(daily_protein, 2),
+        "daily_fat": round_like_model(daily_fat, 2),
+        "daily_fiber": round_like_model(daily_fiber, 2),
+    }
+
+
+#Recomputes and stores the macro targets of one chunk of rows from .values_list(*INPUT_COLUMNS, *TARGET_COLUMNS)
+#Only profiles whose targets changed are written, returns how many were updated
+def _recompute_chunk(rows, today, batch_size):
+    columns = list(zip(*rows))
+    ids = np.array(columns[0])
+    fields = dict(zip(INPUT_COLUMNS[1:], (np.array(column) for column in columns[1:len(INPUT_COLUMNS)])))
+
+    macros = calculate_macros(
+        ages(fields["date_of_birth"].astype("datetime64[D]"), today),
+        fields["gender"],
+        fields["height"].astype(float),
+        fields["weight"].astype(float),
+        fields["activity_level"],
+        fields["goal"],
+        fields["protein_multiplier"].astype(float),
+    )
+
+    #Stored targets can be null, which always counts as changed
+    changed = np.zeros(len(ids), dtype=bool)
+    for offset, name in enumerate(TARGET_COLUMNS, start=len(INPUT_COLUMNS)):
+        stored = np.array([np.nan if value is None else value for value in columns[offset]], dtype=float)
+        changed |= stored != macros[name]
+
+    updated_at = now()
+    profiles = [
+        ClientProfile(
+            id=int(ids[i]),
+            macronutrient_last_updated=updated_at,
+            **{name: macros[name][i].item() for name in TARGET_COLUMNS}
+        )
+        for i in np.flatnonzero(changed)
+    ]
+    with transaction.atomic():
+        ClientProfile.objects.bulk_update(profiles, sorted(MACRO_FIELDS), batch_size=batch_size)
+    return len(profiles)
+
+
+#Recomputes macro targets for every profile in the queryset, chunk_size profiles at a time
+#Chunks are read in id order with keyset pagination so memory stays flat on large tables
+#Yields (profiles processed, profiles updated) after each chunk
+def recompute_macros(queryset=None, chunk_size=5000, batch_size=1000, today=None):
+    queryset = (queryset if queryset is not None else ClientProfile.objects.all()).order_by("id")
+    today = today or date.today()
+    last_id = 0
+
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).values_list(*INPUT_COLUMNS, *TARGET_COLUMNS)[:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield len(rows), _recompute_chunk(rows, today, batch_size)
@@ -1,107 +1,370 @@
-from pulp import LpProblem, LpMinimize, LpVariable, lpSum, LpInteger, LpStatus
+from scipy.optimize import milp, LinearConstraint, Bounds
+from scipy import sparse
+from collections import OrderedDict
+import threading
 import numpy as np
-import pandas as pd
-import os
+from .food_catalog import NUTRIENTS, load_food_catalog
 
-#Load CSV containing food data per serving
-base_dir = os.path.dirname(os.path.abspath(__file__))
-file_path = os.path.join(base_dir, "food_data_with_fiber.csv")
+#Food table merged from the food CSVs, memory-mapped from its snapshot when one exists
+food_catalog = load_food_catalog()
 
-try:
-    food_data = pd.read_csv(file_path)
-except FileNotFoundError:
-    raise FileNotFoundError(f"File could not be found at '{file_path}'")
+#Define 10% tolerance level for targets
+TOLERANCE = 0.1
 
-def generate_meal_new(client, meal_number, previous_foods, num_meals=3):
-    #Daily macronutrient targets are split across meals
-    target_calories = client.daily_calories / num_meals
-    target_protein = client.daily_protein / num_meals
-    target_carbs = client.daily_carbs / num_meals
-    target_fat = client.daily_fat / num_meals
-    target_fiber = client.daily_fiber / num_meals if client.daily_fiber else 8  
+#Cap on servings of a single food in one meal, also bounds foods with no nutrients
+MAX_SERVINGS = 20
+
+#Seconds HiGHS may spend on one solve, the best solution found by then is used
+SOLVE_TIME_LIMIT = 5.0
+
+#Solution cache sizes, number of target/exclusion combinations kept and solutions pooled for each
+CACHE_ENTRIES = 256
+CACHE_POOL_SIZE = 5
+
+#Targets are rounded to these steps for cache keys, calories to 10 kcal and grams to 1 g
+CACHE_TARGET_STEPS = np.array([10, 1, 1, 1, 1])
+
+
+#Integer meal solver for one FoodCatalog
+#The nutrient matrix is built once, each solve only changes the bounds and objective weights
+#Uses SciPy's in-process HiGHS solver so no solver subprocess is spawned per meal
+class MealSolver:
+    def __init__(self, catalog):
+        self.food_names = catalog.names
+        self.index_by_name = {name: i for i, name in enumerate(self.food_names)}
+
+        #One row per nutrient, one column per food
+        self.nutrients = np.array(catalog.nutrients, dtype=float).T
+        self.serving_weights = np.array(catalog.serving_weights, dtype=float)
+        self.integrality = np.ones(len(self.food_names))
+
+        #Hash of the catalog's sources, so cached solutions from another table are never reused
+        self.version = catalog.version
+
+    def __len__(self):
+        return len(self.food_names)
+
+    #Column indexes of the given food names that exist in this table
+    def indexes_of(self, names):
+        return [self.index_by_name[name] for name in names if name in self.index_by_name]
+
+    #Most servings of each food a meal can hold before breaking an upper bound, one row per meal
+    #Bounding every variable keeps infeasible problems from branching without end
+    def max_servings(self, upper):
+        with np.errstate(divide="ignore"):
+            ratios = np.where(self.nutrients > 0, upper[:, :, None] / self.nutrients[None, :, :], np.inf)
+        return np.minimum(np.floor(ratios.min(axis=1)), MAX_SERVINGS)
+
+    #Solves for whole servings of each food so every nutrient is within tolerance of its target
+    #targets follows NUTRIENTS, excluded foods are fixed at 0 servings
+    #Returns an array of servings per food, or None if no solution was found
+    def solve(self, targets, excluded=(), tolerance=TOLERANCE, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
+        n = len(self.food_names)
+        targets = np.asarray(targets, dtype=float)
+
+        #Excluded foods get an upper bound of 0 rather than being removed from the matrix
+        max_servings = self.max_servings(np.atleast_2d((1 + tolerance) * targets))[0]
+        upper = max_servings.copy()
+        upper[self.indexes_of(excluded)] = 0
+
+        #If available foods after filtering is too short uses full list
+        if np.count_nonzero(upper) < 3:
+            upper = max_servings
+
+        #Weights are randomly distributed from 1 to 1.3, n weights are made for each food
+        #These weights are used as the costs in the objective function to encourage variety
+        weights = rng.uniform(1.0, 1.3, n)
+
+        #Macronutrient constraints with tolerance, one row per nutrient
+        constraints = LinearConstraint(self.nutrients, (1 - tolerance) * targets, (1 + tolerance) * targets)
+
+        result = milp(
+            c=weights,
+            constraints=constraints,
+            integrality=self.integrality,
+            bounds=Bounds(np.zeros(n), upper),
+            options={"time_limit": SOLVE_TIME_LIMIT},
+        )
+        if result.x is None:
+            return None
+
+        #Solver returns floats that are integral up to tolerance
+        return np.round(result.x)
+
+    #Solves every meal of a day as one problem, returns one servings array per meal or None
+    #meal_targets has one row of targets per meal, and each food can be used in at most one meal
+    def solve_day(self, meal_targets, excluded=(), tolerance=TOLERANCE, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
+        meal_targets = np.atleast_2d(np.asarray(meal_targets, dtype=float))
+        num_meals, n = len(meal_targets), len(self.food_names)
+        lower = (1 - tolerance) * meal_targets
+        upper = (1 + tolerance) * meal_targets
+
+        #Used both as the variable bound and as the big-M linking servings to the "food used" binaries
+        max_servings = self.max_servings(upper)
+
+        #Excluded foods are bounded at zero, unless that leaves too few foods
+        excluded_indexes = self.indexes_of(excluded)
+        if n - len(set(excluded_indexes)) >= 3:
+            max_servings[:, excluded_indexes] = 0
+
+        #Variables are servings x[meal, food] followed by binaries y[meal, food], both laid out meal by meal
+        size = num_meals * n
+        meals = sparse.identity(num_meals, format="csr")
+        foods = sparse.identity(n, format="csr")
+        constraints = [
+            #Per meal macro bands
+            LinearConstraint(
+                sparse.hstack([sparse.kron(meals, sparse.csr_matrix(self.nutrients)), sparse.csr_matrix((num_meals * len(NUTRIENTS), size))]),
+                lower.ravel(), upper.ravel()
+            ),
+            #A food can only have servings in a meal it is assigned to
+            LinearConstraint(
+                sparse.hstack([sparse.identity(size), -sparse.diags(max_servings.ravel())]),
+                -np.inf, 0
+            ),
+            #Each food is used in at most one meal
+            LinearConstraint(
+                sparse.hstack([sparse.csr_matrix((n, size)), sparse.kron(np.ones((1, num_meals)), foods)]),
+                0, 1
+            ),
+        ]
+
+        #Randomised costs on servings for variety, the binaries are free
+        weights = np.concatenate([rng.uniform(1.0, 1.3, size), np.zeros(size)])
+
+        result = milp(
+            c=weights,
+            constraints=constraints,
+            integrality=np.ones(2 * size),
+            bounds=Bounds(np.zeros(2 * size), np.concatenate([max_servings.ravel(), np.ones(size)])),
+            #The costs are only random variety weights, so the first feasible day is as good as the optimum
+            options={"mip_rel_gap": 1.0, "time_limit": SOLVE_TIME_LIMIT},
+        )
+        if result.x is None:
+            return None
+
+        return list(np.round(result.x[:size]).reshape(num_meals, n))
+
+    #Whether every meal's totals are within tolerance of its targets
+    def within_targets(self, servings, targets, tolerance=TOLERANCE):
+        totals = np.atleast_2d(servings) @ self.nutrients.T
+        targets = np.atleast_2d(targets)
+        return bool(np.all((totals >= (1 - tolerance) * targets - 1e-9) & (totals <= (1 + tolerance) * targets + 1e-9)))
+
+    #Turns solver output into the food dictionaries stored in MealPlan
+    def meal_items(self, servings):
+        meal_plan = []
+        for i in np.flatnonzero(servings > 0):
+            amount = float(servings[i])
+            calories, protein, carbs, fats, fiber = self.nutrients[:, i]
+            meal_plan.append({
+                'food_name': self.food_names[i],
+                'weight_in_grams': amount * self.serving_weights[i],
+                'calories': round(calories * amount, 2),
+                'protein': round(protein * amount, 2),
+                'carbs': round(carbs * amount, 2),
+                'fats': round(fats * amount, 2),
+                'fiber': round(fiber * amount, 2),
+                'servings': amount
+            })
+        return meal_plan
+
+
+#Pools of feasible solutions keyed by food table version, rounded targets, excluded foods and dietary preference
+#Clients with similar targets share a pool, so most requests pick a stored solution instead of solving
+#Least recently used keys are evicted once CACHE_ENTRIES is reached
+class SolutionCache:
+    def __init__(self, max_entries=CACHE_ENTRIES, pool_size=CACHE_POOL_SIZE):
+        self.max_entries = max_entries
+        self.pool_size = pool_size
+        self.pools = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pools)
+
+    @staticmethod
+    def key(solver, kind, targets, excluded=(), preference="any"):
+        rounded = tuple(np.round(np.atleast_2d(targets) / CACHE_TARGET_STEPS).astype(int).ravel())
+        return (solver.version, kind, np.shape(np.atleast_2d(targets))[0], rounded, frozenset(excluded), preference)
 
-    #Define 10% tolerance level for targets
-    tolerance = 0.1
+    #Returns a stored solution that fits the exact targets, or calls solve for a new one and pools it
+    #Pools are filled up to pool_size before any solution is reused, so repeated requests still vary
+    def get(self, key, fits, solve, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is not None:
+                self.pools.move_to_end(key)
+                pool = list(pool)
 
-    #Filters out previous foods
-    available_foods = food_data[~food_data["Food Name"].isin(previous_foods)].copy()
+        if pool is not None and len(pool) >= self.pool_size:
+            #Rounded keys can put clients near the edge of a bucket outside a solution's band
+            candidates = [solution for solution in pool if fits(solution)]
+            if candidates:
+                return candidates[rng.integers(len(candidates))]
 
-    #If available foods after filtering is too short uses full list
-    if len(available_foods) < 3:
-        available_foods = food_data.copy()
+        solution = solve()
+        if solution is not None:
+            self.add(key, solution)
+        return solution
 
-    #Extract values
-    food_names = available_foods["Food Name"].tolist()
-    calories = available_foods["Calories per Serving"].tolist()
-    protein = available_foods["Protein per Serving"].tolist()
-    carbs = available_foods["Carbs per Serving"].tolist()
-    fats = available_foods["Fat per Serving"].tolist()
-    fiber = available_foods["Fiber per Serving"].tolist()
+    def add(self, key, solution):
+        with self.lock:
+            pool = self.pools.setdefault(key, [])
+            self.pools.move_to_end(key)
+            if len(pool) < self.pool_size:
+                pool.append(solution)
+            while len(self.pools) > self.max_entries:
+                self.pools.popitem(last=False)
 
-    #Stores number of foods
-    n = len(food_names)
+    def clear(self):
+        with self.lock:
+            self.pools.clear()
 
-    #Setting up LP problem as integer minimisation problem
-    prob = LpProblem("Meal_Plan", LpMinimize)
-    x = [LpVariable(f"x_{i}", lowBound=0, cat=LpInteger) for i in range(n)]
 
-    #Randomized objective to encourage variety
-    np.random.seed()
+#One solver per dietary preference, each holding only the foods that preference allows
+#Built once at import so restricted diets solve smaller problems and never see ineligible foods
+#Foods missing a nutrient can't be constrained, so they are left out
+meal_solvers = {preference: MealSolver(foods) for preference, foods in food_catalog.complete().by_preference().items()}
 
-    #Weights are randomly distributed from 1 to 1.3, n weights are made for each food
-    #These weights are used as the costs in the objective function
-    weights = np.random.uniform(1.0, 1.3, n)
+#Solver for the full food table
+meal_solver = meal_solvers["any"]
 
-    #Defines the objective function, minimise the weighted sum of servings
-    prob += lpSum([weights[i] * x[i] for i in range(n)]), "Randomised Total Cost"
+#Shared solution cache for the meal solvers in this process
+solution_cache = SolutionCache()
 
-    #Macronutrient constraints with tolerance
-    #Calorie constraints
-    prob += lpSum([calories[i] * x[i] for i in range(n)]) >= (1 - tolerance) * target_calories
-    prob += lpSum([calories[i] * x[i] for i in range(n)]) <= (1 + tolerance) * target_calories
 
-    #Protein constraints
-    prob += lpSum([protein[i] * x[i] for i in range(n)]) >= (1 - tolerance) * target_protein
-    prob += lpSum([protein[i] * x[i] for i in range(n)]) <= (1 + tolerance) * target_protein
+#Solves one meal through the solution cache
+def cached_solve(solver, targets, excluded=(), preference="any"):
+    key = SolutionCache.key(solver, "meal", targets, excluded, preference)
+    return solution_cache.get(
+        key,
+        fits=lambda servings: solver.within_targets(servings, targets),
+        solve=lambda: solver.solve(targets, excluded=excluded),
+    )
 
-    #Carbohydrate constraints
-    prob += lpSum([carbs[i] * x[i] for i in range(n)]) >= (1 - tolerance) * target_carbs
-    prob += lpSum([carbs[i] * x[i] for i in range(n)]) <= (1 + tolerance) * target_carbs
 
-    #Fat constraints
-    prob += lpSum([fats[i] * x[i] for i in range(n)]) >= (1 - tolerance) * target_fat
-    prob += lpSum([fats[i] * x[i] for i in range(n)]) <= (1 + tolerance) * target_fat
+#Day solutions are pooled as one array with a row per meal
+def _as_array(day):
+    return None if day is None else np.array(day)
 
-    #Fiber constraints
-    prob += lpSum([fiber[i] * x[i] for i in range(n)]) >= (1 - tolerance) * target_fiber
-    prob += lpSum([fiber[i] * x[i] for i in range(n)]) <= (1 + tolerance) * target_fiber
 
-    #Solve the defined problem
-    result_status = prob.solve()
+#Solves every meal of a day through the solution cache, returns a servings array per meal or None
+def cached_solve_day(solver, meal_targets, excluded=(), preference="any"):
+    key = SolutionCache.key(solver, "day", meal_targets, excluded, preference)
+    day = solution_cache.get(
+        key,
+        fits=lambda servings: solver.within_targets(servings, meal_targets),
+        solve=lambda: _as_array(solver.solve_day(meal_targets, excluded=excluded)),
+    )
+    return None if day is None else list(day)
+
+
+#Carb limits of carb restricted preferences, fat makes up the calories the carbs no longer cover
+#Ketogenic allows this many grams of net carbs a day on top of the fiber target
+KETO_NET_CARBS = 30
+
+#Low-carb gets at most this share of its calories from carbs
+LOW_CARB_CALORIE_SHARE = 0.2
+
+
+#Daily carb limit for a preference, or None if carbs aren't restricted
+def carb_limit(preference, calories, fiber):
+    if preference == "ketogenic":
+        return fiber + KETO_NET_CARBS
+    if preference == "low_carb":
+        return calories * LOW_CARB_CALORIE_SHARE / 4
+    return None
+
+
+#Vegan foods can't reach high protein targets, vegan clients get at most this share of their calories from protein
+VEGAN_PROTEIN_CALORIE_SHARE = 0.3
+
+
+#Daily protein limit for a preference, or None if protein isn't restricted
+def protein_limit(preference, calories):
+    if preference == "vegan":
+        return calories * VEGAN_PROTEIN_CALORIE_SHARE / 4
+    return None
+
+
+#Per meal targets in NUTRIENTS order, daily macronutrient targets are split across meals
+#Carb restricted preferences move calories from carbs to fat, and vegan clients move them from protein to carbs,
+#as their food tables can't reach the standard split
+def meal_targets(client, num_meals=3):
+    protein, carbs, fat = client.daily_protein, client.daily_carbs, client.daily_fat
+    fiber = client.daily_fiber if client.daily_fiber else 8 * num_meals
+
+    limit = protein_limit(client.dietary_preference, client.daily_calories)
+    if limit is not None and protein > limit:
+        carbs += protein - limit
+        protein = limit
+
+    limit = carb_limit(client.dietary_preference, client.daily_calories, fiber)
+    if limit is not None and carbs > limit:
+        fat += (carbs - limit) * 4 / 9
+        carbs = limit
+
+    return [
+        client.daily_calories / num_meals,
+        protein / num_meals,
+        carbs / num_meals,
+        fat / num_meals,
+        fiber / num_meals,
+    ]
+
+
+#Solver for a dietary preference, unknown preferences use the full food table
+def solver_for(preference):
+    return meal_solvers.get(preference, meal_solver)
+
+
+#Solves one meal for per meal targets, foods in previous_foods are excluded and the chosen foods are added to it
+def solve_meal(targets, previous_foods, preference="any"):
+    solver = solver_for(preference)
+    servings = cached_solve(solver, targets, excluded=previous_foods, preference=preference)
 
     #Process result and return structured food plan
     meal_plan = []
-    if LpStatus[prob.status] == "Optimal":
-        for i in range(n):
-            #Extracts decision variable after problem has been solved
-            #This contains the number of servings for that food
-            servings = x[i].varValue
-
-            #Any food with more than 0 servings is appended to the meal plan
-            if servings and servings > 0:
-                meal_plan.append({
-                    'food_name': food_names[i],
-                    'weight_in_grams': servings * available_foods.iloc[i]["Serving Weight (g)"], 
-                    'calories': round(calories[i] * servings, 2),
-                    'protein': round(protein[i] * servings, 2),
-                    'carbs': round(carbs[i] * servings, 2),
-                    'fats': round(fats[i] * servings, 2),
-                    'fiber': round(fiber[i] * servings, 2),
-                    'servings': float(servings)
-
-                })
-                previous_foods.add(food_names[i])
+    if servings is not None:
+        meal_plan = solver.meal_items(servings)
+        previous_foods.update(item['food_name'] for item in meal_plan)
     else:
         print("Failed to find an optimal solution")
 
     return meal_plan
+
+
+#Solves every meal of a day with one joint solve, so meals never share a food
+#Falls back to solving meals one at a time if the joint problem has no solution
+def solve_day_meals(targets, num_meals=3, excluded=(), preference="any"):
+    solver = solver_for(preference)
+    day = cached_solve_day(solver, [targets] * num_meals, excluded=excluded, preference=preference)
+
+    if day is None:
+        previous_foods = set(excluded)
+        meals = [solve_meal(targets, previous_foods, preference) for _ in range(num_meals)]
+
+        #Restricted food tables can run out of unused foods, those meals may repeat foods from earlier meals
+        return [meal or solve_meal(targets, set(excluded), preference) for meal in meals]
+
+    return [solver.meal_items(servings) for servings in day]
+
+
+def generate_meal_new(client, meal_number, previous_foods, num_meals=3):
+    #Solves the meal, previous foods are excluded
+    return solve_meal(meal_targets(client, num_meals), previous_foods, client.dietary_preference)
+
+
+#Generates every meal of a client's day, see solve_day_meals
+def generate_day_meals(client, num_meals=3, excluded=()):
+    return solve_day_meals(meal_targets(client, num_meals), num_meals, excluded, client.dietary_preference)
+
+
+#Process pool entry point for bulk regeneration
+#Takes plain targets rather than a ClientProfile so workers never need Django, returns (client_id, meals)
+def solve_day_meals_task(client_id, targets, num_meals=3, preference="any"):
+    return client_id, solve_day_meals(targets, num_meals, preference=preference)
@@ -0,0 +1,74 @@
+import codecs
+import csv
+import json
+import math
+from django.db import transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_date
+from users.models import WeightProgress
+from users.utils.weight_rollups import iso_week, rebuild_rollups
+
+#Bulk import of weight entries, e.g. a scale app sync or a spreadsheet export
+
+#Most entries accepted in one import, and how many are written per query
+MAX_ENTRIES = 10000
+CHUNK_SIZE = 500
+
+
+#Reads (date, weight) pairs from a JSON array of {"date", "weight"} objects or a CSV with date and weight columns
+#Raises ValueError with a message for the client if any entry is invalid
+def parse_weight_entries(stream, content_type):
+    if content_type.startswith("text/csv"):
+        #utf-8-sig drops the byte order mark spreadsheet tools write at the start of CSV exports
+        records = csv.DictReader(codecs.iterdecode(stream, "utf-8-sig"))
+    else:
+        records = json.load(stream)
+        if isinstance(records, dict):
+            records = records.get("entries")
+        if not isinstance(records, list):
+            raise ValueError("Expected a list of entries.")
+
+    entries = []
+    for line, record in enumerate(records, start=1):
+        if len(entries) >= MAX_ENTRIES:
+            raise ValueError(f"At most {MAX_ENTRIES} entries can be imported at once.")
+        try:
+            entry_date = parse_date(str(record.get("date", "")).strip())
+            weight = float(record.get("weight"))
+        except (AttributeError, TypeError, ValueError):
+            entry_date = weight = None
+
+        #float() accepts "inf" and "nan", and JSON can hold Infinity and NaN, so the weight must be finite
+        if not entry_date or weight is None or not math.isfinite(weight) or not weight > 0:
+            raise ValueError(f"Entry {line} needs a valid date and a positive, finite weight.")
+        entries.append((entry_date, weight))
+    return entries
+
+
+#Upserts weight entries for a client in one transaction, an entry replaces any existing one on the same date
+#If the import contains the client's newest entry, that weight is applied to the profile so macros are recalculated once
+#Returns the number of entries stored
+def import_weight_entries(client, entries):
+    #Later entries in the import win over earlier ones for the same date
+    by_date = dict(entries)
+    if not by_date:
+        return 0
+    dates = sorted(by_date)
+
+    with transaction.atomic():
+        latest_stored = WeightProgress.objects.filter(client=client).aggregate(latest=Max('date'))['latest']
+
+        for start in range(0, len(dates), CHUNK_SIZE):
+            chunk = dates[start:start + CHUNK_SIZE]
+            WeightProgress.objects.filter(client=client, date__in=chunk).delete()
+            WeightProgress.objects.bulk_create([
+                WeightProgress(client=client, date=entry_date, weight=by_date[entry_date]) for entry_date in chunk
+            ])
+
+        rebuild_rollups(client, {iso_week(entry_date) for entry_date in dates})
+
+        if latest_stored is None or dates[-1] >= latest_stored:
+            client.weight = by_date[dates[-1]]
+            client.save()
+
+    return len(dates)
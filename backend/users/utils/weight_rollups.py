@@ -0,0 +1,108 @@
+from datetime import date, timedelta
+from itertools import groupby
+from django.db import IntegrityError, transaction
+from users.models import WeightProgress, WeeklyWeightRollup
+
+#Keeps WeeklyWeightRollup in step with WeightProgress
+#New entries are folded into their week's row, edited or imported weeks are rebuilt from their entries
+
+
+#ISO (year, week) of a date
+def iso_week(entry_date):
+    year, week, _ = entry_date.isocalendar()
+    return year, week
+
+
+#Unsaved rollups from (client_id, date, weight) rows ordered by client, date and id
+def _rollups_from_rows(rows):
+    for (client_id, year, week), entries in groupby(rows, key=lambda row: (row[0], *iso_week(row[1]))):
+        entries = list(entries)
+        weights = [weight for _, _, weight in entries]
+        yield WeeklyWeightRollup(
+            client_id=client_id,
+            iso_year=year,
+            iso_week=week,
+            min_weight=min(weights),
+            max_weight=max(weights),
+            mean_weight=sum(weights) / len(weights),
+            last_weight=weights[-1],
+            last_date=entries[-1][1],
+            count=len(weights),
+        )
+
+
+#Folds one new weight entry into its week's rollup
+def add_to_rollup(client, entry_date, weight):
+    weight = float(weight)
+    year, week = iso_week(entry_date)
+
+    week_rollup = WeeklyWeightRollup.objects.select_for_update().filter(client=client, iso_year=year, iso_week=week)
+    with transaction.atomic():
+        rollup = week_rollup.first()
+        if rollup is None:
+            #The first entry of the week creates its row, in a savepoint so a concurrent insert can be recovered from
+            try:
+                with transaction.atomic():
+                    next(_rollups_from_rows([(client.id, entry_date, weight)])).save()
+                return
+            except IntegrityError:
+                #Another request created the week's row first, this entry is folded into it instead
+                rollup = week_rollup.get()
+
+        rollup.min_weight = min(rollup.min_weight, weight)
+        rollup.max_weight = max(rollup.max_weight, weight)
+        rollup.mean_weight = (rollup.mean_weight * rollup.count + weight) / (rollup.count + 1)
+        rollup.count += 1
+        if entry_date >= rollup.last_date:
+            rollup.last_weight = weight
+            rollup.last_date = entry_date
+        rollup.save()
+
+
+#Rebuilds a client's rollups for the given (year, week) pairs from their weight entries
+def rebuild_rollups(client, weeks):
+    weeks = set(weeks)
+    if not weeks:
+        return
+
+    #Only entries between the first and last affected week are read
+    starts = [date.fromisocalendar(year, week, 1) for year, week in weeks]
+    rows = (
+        WeightProgress.objects
+        .filter(client=client, date__gte=min(starts), date__lt=max(starts) + timedelta(days=7))
+        .order_by('date', 'id')
+        .values_list('client_id', 'date', 'weight')
+    )
+    rollups = [rollup for rollup in _rollups_from_rows(rows) if (rollup.iso_year, rollup.iso_week) in weeks]
+
+    with transaction.atomic():
+        for year, week in weeks:
+            WeeklyWeightRollup.objects.filter(client=client, iso_year=year, iso_week=week).delete()
+        WeeklyWeightRollup.objects.bulk_create(rollups)
+
+
+#Rebuilds every client's rollups from scratch, streaming entries in client and date order
+#Returns the number of entries read and rollups written
+def backfill_rollups(batch_size=5000):
+    rows = (
+        WeightProgress.objects
+        .order_by('client_id', 'date', 'id')
+        .values_list('client_id', 'date', 'weight')
+        .iterator(chunk_size=batch_size)
+    )
+    entries = written = 0
+    batch = []
+
+    with transaction.atomic():
+        WeeklyWeightRollup.objects.all().delete()
+        for rollup in _rollups_from_rows(rows):
+            entries += rollup.count
+            batch.append(rollup)
+            if len(batch) >= batch_size:
+                WeeklyWeightRollup.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        WeeklyWeightRollup.objects.bulk_create(batch)
+        written += len(batch)
+
+    return entries, written
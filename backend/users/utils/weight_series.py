@@ -0,0 +1,58 @@
+import numpy as np
+from users.models import WeightProgress
+
+#Weight history served to charts, downsampled so the payload stays bounded however long the history is
+
+#Points returned when the request doesn't ask for a number, and the most it can ask for
+DEFAULT_POINTS = 500
+MAX_POINTS = 2000
+
+
+#Largest-Triangle-Three-Buckets downsampling, returns the indexes of the points to keep
+#Always keeps the first and last points, and from each bucket in between keeps the point
+#forming the largest triangle with the previously kept point and the average of the next bucket
+def lttb_indexes(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    #Bucket boundaries for the points between the first and last, threshold - 2 buckets of at least one point
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = [0]
+    previous = 0
+
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        #The last bucket looks ahead to the final point
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected.append(previous)
+
+    selected.append(n - 1)
+    return np.array(selected)
+
+
+#A client's weight entries between two dates (inclusive), downsampled to at most points entries
+#Reads through the (client, date) index and only loads the two columns needed
+def weight_series(client, date_from=None, date_to=None, points=DEFAULT_POINTS):
+    entries = WeightProgress.objects.filter(client=client)
+    if date_from:
+        entries = entries.filter(date__gte=date_from)
+    if date_to:
+        entries = entries.filter(date__lte=date_to)
+    rows = list(entries.order_by('date', 'id').values_list('date', 'weight'))
+
+    if len(rows) > points:
+        x = np.array([entry_date.toordinal() for entry_date, _ in rows], dtype=float)
+        y = np.array([weight for _, weight in rows], dtype=float)
+        rows = [rows[i] for i in lttb_indexes(x, y, points)]
+
+    return [{"date": entry_date.strftime("%Y-%m-%d"), "weight": weight} for entry_date, weight in rows]
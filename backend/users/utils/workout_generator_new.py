@@ -1,51 +1,26 @@
-import pandas as pd
-import random
-import os
-from collections import defaultdict
-
-def load_exercise_data():
-    #Get CSV path
-    base_path = os.path.dirname(__file__)
-    csv_file = os.path.join(base_path, "exercise_database_full.csv")
-
-    # Load CSV remove any potential trailing spaces
-    df = pd.read_csv(csv_file)
-    df.columns = [col.strip() for col in df.columns]
-
-    #required columns
-    must_have_columns = [
-        "Exercise",
-        "Difficulty Level",
-        "Target Muscle Group",
-        "Primary Equipment",
-        "Exercise Classification",
-        "Mechanics"
-    ]
-    missing = [col for col in must_have_columns if col not in df.columns]
-
-    if missing:
-        #If CSV has wrong structure, raise error
-        raise ValueError(f"Missing columns in the CSV: {missing}. Found: {list(df.columns)}")
-
-    return df
+import numpy as np
+from .exercise_catalog import get_exercise_catalog
 
 #Function that constructs the workout plan
-def generate_workout_plan(workout_days, muscle_groups_per_day, difficulty_level, equipment_available, priority_muscles=None):
-    df = load_exercise_data()
+def generate_workout_plan(workout_days, muscle_groups_per_day, difficulty_level, equipment_available, priority_muscles=None, rng=None):
+    catalog = get_exercise_catalog()
+    df = catalog.df
+    rng = rng if rng is not None else np.random.default_rng()
 
-    df["Exercise Classification"] = df["Exercise Classification"].str.lower().str.strip()
-    df = df[df["Exercise Classification"] == "bodybuilding"]
+    #Boolean mask over catalog rows, only bodybuilding exercises are used
+    allowed = (df["classification_norm"] == "bodybuilding").to_numpy()
 
     if equipment_available:
         #Filters by provided available equipment
-        df = df[df["Primary Equipment"].isin(equipment_available)]
+        allowed &= df["Primary Equipment"].isin(equipment_available).to_numpy()
 
-    #Groups exercises by muscle group
-    grouped_by_muscle = defaultdict(list)
-    for _, entry in df.iterrows():
-        muscle_list = [m.strip().lower() for m in str(entry["Target Muscle Group"]).split(",")]
-        for m in muscle_list:
-            grouped_by_muscle[m].append(entry)
+    #Returns the allowed row IDs for a muscle, optionally restricted to one type of mechanics
+    def bucket(muscle, mechanics=None):
+        if mechanics is None:
+            rows = catalog.rows_for(catalog.by_muscle, muscle)
+        else:
+            rows = catalog.rows_for(catalog.by_muscle_mechanics, (muscle, mechanics))
+        return rows[allowed[rows]]
 
     #Final workout plan structure
     final_plan = {}
@@ -71,36 +46,29 @@ def generate_workout_plan(workout_days, muscle_groups_per_day, difficulty_level,
 
         for raw_muscle in muscle_day:
             muscle = raw_muscle.strip().lower()
-            if muscle not in grouped_by_muscle:
+            options = bucket(muscle)
+            if options.size == 0:
                 continue 
 
-            options = grouped_by_muscle[muscle]
-            random.shuffle(options)  
-
-            #Separate into compound and isolation exercises
-            compounds = [ex for ex in options if str(ex.get("Mechanics", "")).strip().lower() == "compound"]
-            isolations = [ex for ex in options if str(ex.get("Mechanics", "")).strip().lower() == "isolation"]
+            #Separate into compound and isolation exercises, both are arrays of row IDs
+            compounds = bucket(muscle, "compound")
+            isolations = bucket(muscle, "isolation")
 
             selected = []
 
             #Always try to start with a compound movement
-            if compounds:
-                selected.append(random.choice(compounds))
+            if compounds.size:
+                selected.append(int(rng.choice(compounds)))
 
             #Fill the rest with isolation, fall back if necessary
             needed_more = per_muscle - len(selected)
-            already_picked = set(ex["Exercise"] for ex in selected)
-
-            iso_pool = [ex for ex in isolations if ex["Exercise"] not in already_picked]
-            other_pool = [ex for ex in options if ex["Exercise"] not in already_picked]
-
-            if iso_pool:
-                random.shuffle(iso_pool)
-                selected.extend(iso_pool[:needed_more])
+            iso_pool = np.setdiff1d(isolations, selected, assume_unique=True)
+            if iso_pool.size and needed_more > 0:
+                selected.extend(rng.permutation(iso_pool)[:needed_more].tolist())
 
             if len(selected) < per_muscle:
-                random.shuffle(other_pool)
-                selected.extend(other_pool[:per_muscle - len(selected)])
+                other_pool = np.setdiff1d(options, selected, assume_unique=True)
+                selected.extend(rng.permutation(other_pool)[:per_muscle - len(selected)].tolist())
 
             if muscle in priority_muscles:
                 day_priority.extend(selected)
@@ -112,13 +80,7 @@ def generate_workout_plan(workout_days, muscle_groups_per_day, difficulty_level,
         #Combines to get all exercises for a given day
         all_exercises = day_priority + day_big + day_misc
 
-        final_plan[f"Day {i}"] = [
-            {
-                "exercise_name": ex["Exercise"],
-                "target_muscle": ex["Target Muscle Group"],
-                "equipment": ex["Primary Equipment"],
-                "mechanics": ex["Mechanics"]
-            } for ex in all_exercises
-        ]
+        #Rows are only turned into dictionaries once the selection is final
+        final_plan[f"Day {i}"] = catalog.exercise_dicts(all_exercises)
 
     return final_plan
@@ -4,13 +4,26 @@ from django.contrib.auth.views import LoginView
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.utils.dateparse import parse_date
+from django.db import transaction
+from django.db.models import Q
+from datetime import date, timedelta
 from .forms import ClientSignupForm, TrainerSignupForm, CustomLoginForm
-from .models import TrainerProfile, ClientProfile, PTRequest, CustomUser, WeightProgress, MealPlan, WorkoutPlan, WorkoutPlanDay, WorkoutPlanRating, Season, Leaderboard, MealPlanNote, WorkoutPlanNote, SavedWorkout
+from .models import TrainerProfile, ClientProfile, PTRequest, CustomUser, WeightProgress, MealPlan, WorkoutPlan, WorkoutPlanDay, WorkoutPlanRating, Season, MealPlanNote, WorkoutPlanNote, SavedWorkout, WeeklyWeightRollup, PlanJob
 from django.views.decorators.csrf import csrf_exempt
 import json
-from .utils.workout_generator_new import generate_workout_plan, load_exercise_data
+import random
+from .utils.exercise_catalog import get_exercise_catalog
+from .serializers import with_rating_summary, serialize_plan_summary, saved_plans_for, serialize_plan_with_days
+from .trainer_search import search_trainers as find_trainers, DEFAULT_PAGE_SIZE as DEFAULT_SEARCH_PAGE_SIZE
+from .leaderboard import award_points, award_points_bulk, get_ranked_leaderboard
+from .roster import parse_roster_params, roster_page, RosterQueryError
+from .persistence import replace_meal, replace_workout_days, create_workout_plan, day_number_from_key
+from .jobs import enqueue_job, serialize_job, JobConflictError
 from .utils.meal_generator_new import generate_meal_new
-from .utils.knn_recommender import get_top_recommended_workouts_for_client
+from .utils.knn_recommender import get_top_recommended_workouts_for_client, get_precomputed_recommendations
+from .utils.weight_series import weight_series, DEFAULT_POINTS, MAX_POINTS
+from .utils.weight_rollups import add_to_rollup
+from .utils.weight_import import parse_weight_entries, import_weight_entries
 
 
 # Create your views here.
@@ -127,15 +140,24 @@ def get_user_data(request):
         return JsonResponse({"user_type": "Invalid"})
 
 
+#Searches trainers for clients looking for one
+#username= matches the start of usernames as the client types, q= matches words in usernames and bios
+#Results are capped, limit= and offset= page through them
 def search_trainers(request):
-    #Retrieves query parameter from URL containing username
-    query = request.GET.get('username', '').strip()
-
-    #If there is a query, performs search 
-    #Trainer profile has foreign key "user"
-    #user__username refers to use on the related user objective
-    #icontains does a case insensitive search using Django's ORM
-    trainers = TrainerProfile.objects.filter(user__username__icontains=query) if query else []
+    username = request.GET.get('username', '').strip()
+    text = request.GET.get('q', '').strip()
+
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_SEARCH_PAGE_SIZE))
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Limit and offset must be whole numbers.'}, status=400)
+
+    if text:
+        trainers, has_more = find_trainers(text, mode='text', limit=limit, offset=offset)
+    else:
+        trainers, has_more = find_trainers(username, mode='prefix', limit=limit, offset=offset)
+
     data = [
         {
             'username': trainer.user.username,
@@ -143,7 +165,7 @@ def search_trainers(request):
         }
         for trainer in trainers
     ]
-    return JsonResponse({'trainers': data})
+    return JsonResponse({'trainers': data, 'has_more': has_more})
 
 @csrf_exempt
 def send_request(request):
@@ -220,43 +242,49 @@ def respond_to_request(request, request_id):
     else:
         return JsonResponse({'error': f'Received action didnt match an expected value {action}'}, status=400)
 
+#One page of the logged in trainer's clients
+#Supports fields=, sort=, goal=, activity_level=, limit= and the cursor= returned by the previous page
 @login_required
 def get_trainer_clients(request):
     if not hasattr(request.user, 'trainer_profile'):
         return JsonResponse({'error': 'You must be a trainer to view clients.'}, status=403)
 
-    #Fetches all clients assigned to the logged in trainer
-    clients = ClientProfile.objects.filter(trainer=request.user)
+    try:
+        options = parse_roster_params(request.GET)
+        client_data, next_cursor = roster_page(request.user, **options)
+    except RosterQueryError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-    #Loops through each client and returns the necessary data
-    client_data = [
-        {
-            'id': client.id,
-            'username': client.user.username,
-            'first_name': client.user.first_name,
-            'last_name': client.user.last_name,
-            'email': client.user.email,
-            'date_of_birth': client.date_of_birth.strftime('%Y-%m-%d'),
-            'gender': client.gender,
-            'height': client.height,
-            'weight': client.weight,
-            'goal': client.goal,
-            'goal_label': client.get_goal_display(),
-
-            "priority_muscles": client.priority_muscles,
-            'profile_picture': client.profile_picture.url if client.profile_picture else None,
-
-            'protein_multiplier': client.protein_multiplier if client.protein_multiplier else 1.8,
-            'daily_calories': client.daily_calories if client.daily_calories else 0,
-            'daily_carbs': client.daily_carbs if client.daily_carbs else 0,
-            'daily_protein': client.daily_protein if client.daily_protein else 0,
-            'daily_fat': client.daily_fat if client.daily_fat else 0,
-            'daily_fiber': client.daily_fiber if client.daily_fiber else 0,
-        }
-        for client in clients
-    ]
+    return JsonResponse({'clients': client_data, 'next_cursor': next_cursor})
+
+#Weekly weight summaries for every client on the trainer's roster, read from the rollup table
+#weeks limits how far back the summaries go, defaults to 12
+@login_required
+def get_roster_weight_trends(request):
+    if not hasattr(request.user, 'trainer_profile'):
+        return JsonResponse({'error': 'You must be a trainer to view clients.'}, status=403)
 
-    return JsonResponse({'clients': client_data}, safe=False)
+    try:
+        weeks = int(request.GET.get('weeks', 12))
+    except ValueError:
+        return JsonResponse({'error': 'Weeks must be a whole number.'}, status=400)
+
+    since = date.today() - timedelta(weeks=weeks)
+    rollups = WeeklyWeightRollup.objects.filter(client__trainer=request.user, last_date__gte=since)
+
+    trends = {}
+    for rollup in rollups:
+        trends.setdefault(rollup.client_id, []).append({
+            'year': rollup.iso_year,
+            'week': rollup.iso_week,
+            'min': rollup.min_weight,
+            'max': rollup.max_weight,
+            'mean': round(rollup.mean_weight, 2),
+            'last': rollup.last_weight,
+            'count': rollup.count,
+        })
+
+    return JsonResponse({'trends': [{'client_id': client_id, 'weeks': data} for client_id, data in trends.items()]})
 
 @csrf_exempt 
 def update_weight(request):
@@ -283,8 +311,10 @@ def update_weight(request):
             if not weight_date:
                 return JsonResponse({"error": "Invalid date format."}, status=400)
 
-            #Store weight in WeightProgress
-            WeightProgress.objects.create(client=client_profile, date=weight_date, weight=weight)
+            #Store weight in WeightProgress and folds it into that week's rollup
+            with transaction.atomic():
+                WeightProgress.objects.create(client=client_profile, date=weight_date, weight=weight)
+                add_to_rollup(client_profile, weight_date, weight)
 
             #If weight entry was marked as current weight updates ClientProfile
             if is_current:
@@ -300,6 +330,49 @@ def update_weight(request):
 
     return JsonResponse({"error": "Invalid request method."}, status=405)
 
+#Imports many weight entries in one request, from a JSON array or a CSV with date and weight columns
+#Entries replace any existing entry on the same date, and the newest one updates the client's current weight
+@csrf_exempt
+def import_weights(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method."}, status=405)
+
+    if not hasattr(request.user, 'client_profile'):
+        return JsonResponse({"error": "User is not a client."}, status=403)
+
+    try:
+        entries = parse_weight_entries(request, request.content_type or "")
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        imported = import_weight_entries(request.user.client_profile, entries)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"message": "Weights imported successfully.", "imported": imported}, status=200)
+
+
+#Weight history for a client limited by the optional from, to and points query parameters
+#Returns a 400 response if any of them are invalid
+def weight_progress_response(request, client):
+    try:
+        date_from, date_to = (
+            parse_date(request.GET[key]) if request.GET.get(key) else None for key in ("from", "to")
+        )
+        points = int(request.GET.get("points", DEFAULT_POINTS))
+    except ValueError:
+        return JsonResponse({"error": "Invalid date range or number of points."}, status=400)
+
+    #parse_date returns None for strings that aren't dates at all
+    if (request.GET.get("from") and not date_from) or (request.GET.get("to") and not date_to):
+        return JsonResponse({"error": "Invalid date format."}, status=400)
+
+    if not 3 <= points <= MAX_POINTS:
+        return JsonResponse({"error": f"Points must be between 3 and {MAX_POINTS}."}, status=400)
+
+    data = weight_series(client, date_from, date_to, points)
+    return JsonResponse({"weight_progress": data}, status=200)
 
 @login_required
 def get_weight_progress(request):
@@ -310,18 +383,8 @@ def get_weight_progress(request):
         if not hasattr(user, 'client_profile'):
             return JsonResponse({"error": "User is not a client."}, status=403)
 
-        client_profile = user.client_profile
-
-        #Retrieves all weight progress entries for the client
-        weight_data = WeightProgress.objects.filter(client=client_profile).order_by('date')
-
-        #Formats data for response
-        data = [
-            {"date": weight.date.strftime("%Y-%m-%d"), "weight": weight.weight}
-            for weight in weight_data
-        ]
-
-        return JsonResponse({"weight_progress": data}, status=200)
+        #Retrieves the client's weight progress entries in the requested range, downsampled for charting
+        return weight_progress_response(request, user.client_profile)
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
@@ -339,16 +402,14 @@ def get_client_weight_progress(request, client_id):
         if client.trainer != user:
             return JsonResponse({"error": "Unauthorized access to this client's data."}, status=403)
 
-        weight_data = WeightProgress.objects.filter(client=client).order_by('date')
-        data = [
-            {"date": entry.date.strftime("%Y-%m-%d"), "weight": entry.weight}
-            for entry in weight_data
-        ]
-        return JsonResponse({"weight_progress": data}, status=200)
+        return weight_progress_response(request, client)
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
     
+#Queues generation of a client's meal plan and returns the job to poll with get_plan_job
+#A repeat request while the client's meal plan job is still queued or running returns that job
+#If that job was queued with a different number of meals the request is rejected with a 409 and the active job
 @csrf_exempt
 def generate_meal_plan(request, client_id):
     try:
@@ -356,53 +417,13 @@ def generate_meal_plan(request, client_id):
         data = json.loads(request.body)
         num_meals = data.get('num_meals', 3)
 
-        #Clears old meals
-        MealPlan.objects.filter(client=client).delete()
-
-        #Keeps track of foods that have been used already
-        previous_foods = set()
-
-        meal_plans = []
-
-        for meal_number in range(1, num_meals + 1):
-            #Uses generate_meal_new function imported from script in utils folder
-            #Uses PuLP to generate meal plan fitting client's targets
-            meal_data = generate_meal_new(client, meal_number, previous_foods, num_meals)
-
-            #Iterates through each food returned by the function
-            for item in meal_data:
-                #Saves meal to database
-                meal = MealPlan.objects.create(
-                    client=client,
-                    meal_number=meal_number,
-                    food_name=item['food_name'],
-                    weight_in_grams=item['weight_in_grams'],
-                    calories=item['calories'],
-                    protein=item['protein'],
-                    carbs=item['carbs'],
-                    fats=item['fats'],
-                    fiber=item.get('fiber', 0),
-                    servings=item.get('servings', 1)
-            
-                )
-
-                #Constructs JSON friendly response to get sent back to frontend to be displayed
-                meal_plans.append({
-                    'meal_number': meal_number,
-                    'food_name': item['food_name'],
-                    'weight_in_grams': item['weight_in_grams'],
-                    'calories': item['calories'],
-                    'protein': item['protein'],
-                    'carbs': item['carbs'],
-                    'fats': item['fats'],
-                    'fiber': item.get('fiber', 0),
-                    'servings': item.get('servings', 1)
-                })
-
-        return JsonResponse({'meal_plans': meal_plans}, status=200)
+        job, created = enqueue_job(client, PlanJob.MEAL_PLAN, {'num_meals': num_meals})
+        return JsonResponse(serialize_job(job), status=202)
 
     except ClientProfile.DoesNotExist:
         return JsonResponse({'error': 'Client not found.'}, status=404)
+    except JobConflictError as e:
+        return JsonResponse({**serialize_job(e.job), 'error': str(e)}, status=409)
     
 @csrf_exempt
 def regenerate_single_meal(request, client_id, meal_number):
@@ -416,32 +437,15 @@ def regenerate_single_meal(request, client_id, meal_number):
                 MealPlan.objects.filter(client=client).exclude(meal_number=meal_number).values_list("food_name", flat=True)
             )
 
-            #Deletes the meal plan that is being replaced
-            MealPlan.objects.filter(client=client, meal_number=meal_number).delete()
-
             data = json.loads(request.body)
             num_meals = data.get("num_meals", 3)
 
             meal_data = generate_meal_new(client, meal_number, previous_foods, num_meals)
-            saved_meals = []
-
-            #Stores new meal in the database
-            for item in meal_data:
-                MealPlan.objects.create(
-                    client=client,
-                    meal_number=meal_number,
-                    food_name=item['food_name'],
-                    weight_in_grams=item['weight_in_grams'],
-                    calories=item['calories'],
-                    protein=item['protein'],
-                    carbs=item['carbs'],
-                    fats=item['fats'],
-                    fiber=item.get('fiber', 0),
-                    servings=item.get('servings', 1),
-                )
-                saved_meals.append(item)
-
-            return JsonResponse({'meal_number': meal_number, 'foods': saved_meals}, status=200)
+
+            #Replaces the old meal with the new one in the database
+            replace_meal(client, meal_number, meal_data)
+
+            return JsonResponse({'meal_number': meal_number, 'foods': meal_data}, status=200)
 
         except ClientProfile.DoesNotExist:
             return JsonResponse({'error': 'Client not found.'}, status=404)
@@ -535,65 +539,45 @@ def save_workout_plan_note(request, client_id):
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON"}, status=400)
 
+#Queues generation of a client's workout plan and returns the job to poll with get_plan_job
+#Like generate_meal_plan, a request with different settings while a workout plan job is active gets a 409
 @csrf_exempt
 def generate_workout_plan_view(request, client_id):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
 
-            #Gets number of days for program from request body
-            workout_days = data.get("workout_days", 3)
-
-            #Gets the muscle groups to train for each day
-            muscle_groups_per_day = data.get("muscle_groups_per_day", [])
-
-            #Gets difficuty if provided, otherwise defaults to intermediate
-            difficulty_level = data.get("difficulty_level", "Intermediate")
-
-            #Gets available equipment provided
-            equipment_available = data.get("equipment_available", ["Dumbbell", "Barbell"])
-
-            #Gets client's priority muscles
-            priority_muscles = data.get("priority_muscles", [])
+            #Number of days, muscle groups per day, difficulty, equipment and priority muscles are passed to the generator
+            params = {
+                key: data[key] for key in
+                ("workout_days", "muscle_groups_per_day", "difficulty_level", "equipment_available", "priority_muscles")
+                if key in data
+            }
 
             client = ClientProfile.objects.get(id=client_id)
 
-            #Deletes previous workout plan
-            WorkoutPlan.objects.filter(client=client).delete()
-
-            #Generates the plan using external script in utils folder
-            generated_plan = generate_workout_plan(
-                workout_days, muscle_groups_per_day, difficulty_level, equipment_available, priority_muscles=priority_muscles
-            )
-
-            #Saves the plan to the database
-            new_plan = WorkoutPlan.objects.create(
-                client=client,
-                training_frequency=len(generated_plan)
-            )
-
-            #Saves each day of plan to database
-            for day_number, exercises in generated_plan.items():
-                WorkoutPlanDay.objects.create(
-                    workout_plan=new_plan,
-                    day_number=int(day_number.replace("Day ", "")),
-                    exercises=exercises
-                )
-
-            #Returns generated plan as JSON for frontend
-            return JsonResponse({
-                "message": "Workout plan generated and saved!",
-                "workout_plan": generated_plan,
-                "plan_id": new_plan.id
-            }, status=201)
+            job, created = enqueue_job(client, PlanJob.WORKOUT_PLAN, params)
+            return JsonResponse(serialize_job(job), status=202)
 
         except ClientProfile.DoesNotExist:
             return JsonResponse({"error": "Client not found"}, status=404)
+        except JobConflictError as e:
+            return JsonResponse({**serialize_job(e.job), "error": str(e)}, status=409)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
 
     return JsonResponse({"error": "Invalid request"}, status=405)
 
+#Status, progress and, once done, result of a plan generation job
+#The result has the same format the generation endpoints used to return directly
+#Only the client's trainer and the client themself can see a job
+@login_required
+def get_plan_job(request, job_id):
+    job = get_object_or_404(
+        PlanJob.objects.filter(Q(client__trainer=request.user) | Q(client__user=request.user)), id=job_id
+    )
+    return JsonResponse(serialize_job(job))
+
 @csrf_exempt
 def refresh_exercise(request):
     if request.method == "POST":
@@ -605,26 +589,14 @@ def refresh_exercise(request):
             mechanics = data.get("mechanics", "").strip().lower()
             allowed_equipment = [eq.strip().lower() for eq in data.get("allowed_equipment", [])]
 
-            #Loads exercise dataset
-            df = load_exercise_data()
-
-            #Filters/narrows down the dataframe, only keeping the rows that match the conditions specified
-            df = df[df["Exercise Classification"].str.strip().str.lower() == "bodybuilding"]
-            df = df[df["Target Muscle Group"].str.lower().str.contains(target_muscle)]
-            df = df[df["Mechanics"].str.lower() == mechanics]
-            df = df[df["Primary Equipment"].str.lower().isin(allowed_equipment)]  
+            #Looks up matching exercises in the shared catalog's precomputed indexes
+            catalog = get_exercise_catalog()
+            candidates = catalog.candidates(target_muscle, mechanics, allowed_equipment)
 
-            if not df.empty:
-                #sample(1) chooses a random row from the filtered df
-                #iloc[0] accesses first row from sampled df 
-                new_exercise = df.sample(1).iloc[0]
+            if candidates:
+                #Chooses a random matching row
                 return JsonResponse({
-                    "new_exercise": {
-                        "exercise_name": new_exercise["Exercise"],
-                        "target_muscle": new_exercise["Target Muscle Group"],
-                        "equipment": new_exercise["Primary Equipment"],
-                        "mechanics": new_exercise["Mechanics"]
-                    }
+                    "new_exercise": catalog.exercise_dict(random.choice(candidates))
                 })
             else:
                 return JsonResponse({"new_exercise": None})
@@ -653,16 +625,11 @@ def save_workout_plan(request, client_id):
             if not workout_plan_obj:
                 return JsonResponse({"error": "No workout plan found to update."}, status=404)
 
-            #Update WorkoutPlanDays with the new exercises, deletes old WorkoutPlanDay first
-            WorkoutPlanDay.objects.filter(workout_plan=workout_plan_obj).delete()
-
-            #Stores new workout plan in database
-            for day_number, exercises in workout_plan.items():
-                WorkoutPlanDay.objects.create(
-                    workout_plan=workout_plan_obj,
-                    day_number=int(day_number.replace("Day ", "")),
-                    exercises=exercises
-                )
+            #Replaces the plan's WorkoutPlanDays with the new exercises in one transaction
+            replace_workout_days(
+                workout_plan_obj,
+                ((day_number_from_key(day), exercises) for day, exercises in workout_plan.items())
+            )
 
             return JsonResponse({"message": "Workout plan saved successfully!"}, status=200)
 
@@ -759,21 +726,18 @@ def get_recommended_workouts(request):
     try:
         client = request.user.client_profile
 
-        #Makes use of KNN recommender, which returns top rated workouts from similar clients
-        recommended_plans = get_top_recommended_workouts_for_client(client)
-
-        data = []
-        #Loops through recommended plans and adds them to data, which is returned to frontend
-        for plan in recommended_plans:
-            top_rating = plan.ratings.order_by('-rating').first()
-            rating = plan.ratings.filter(client=client).first()
-            data.append({
-                "plan_id": plan.id,
-                "training_frequency": plan.training_frequency,
-                "created_at": plan.created_at.strftime('%Y-%m-%d'),
-                "workout_name": top_rating.workout_name if top_rating else "Unnamed Plan",
-                "rated_by": top_rating.client.user.username if top_rating else "Unknown"
-            })
+        #Serves recommendations precomputed by the precompute_recommendations command when available
+        recommended_plans = get_precomputed_recommendations(client)
+
+        #Otherwise makes use of KNN recommender, which returns top rated workouts from similar clients
+        if recommended_plans is None:
+            recommended_plans = get_top_recommended_workouts_for_client(client)
+
+        #Top rating, its rater and the client's own rating are resolved in the same query as the plans
+        recommended_plans = with_rating_summary(recommended_plans, client=client)
+
+        #Serialises recommended plans, which are returned to frontend
+        data = [serialize_plan_summary(plan) for plan in recommended_plans]
 
         return JsonResponse({"recommendations": data}, status=200)
 
@@ -838,25 +802,69 @@ def assign_points(request):
         points = data.get("points")
 
         #Gets the client, object, and season
-        client = get_object_or_404(ClientProfile, id=client_id)
+        client = get_object_or_404(ClientProfile.objects.select_related('user'), id=client_id)
         trainer = request.user.trainer_profile
         season = Season.objects.filter(trainer=trainer, is_active=True).first()
 
         if not season:
             return JsonResponse({"error": "No active season found."}, status=400)
-        
-        #Uses objects retrieved from db to create or get current leaderboard entry
-        leaderboard_entry, created = Leaderboard.objects.get_or_create(
-            client=client, trainer=trainer, season=season,
-            defaults={"points": 0}
-        )
-        #Adds on assigned points and saves the objet
-        leaderboard_entry.points += int(points)
-        leaderboard_entry.save()
 
-        return JsonResponse({"message": "Points assigned successfully.", "total_points": leaderboard_entry.points})
+        #Adds the points in the database, cached leaderboards of the season are no longer read after this
+        total_points = award_points(trainer, season, client, int(points))
+
+        return JsonResponse({"message": "Points assigned successfully.", "total_points": total_points})
     return JsonResponse({"error": "Invalid request method."}, status=405)
 
+#Awards points to many clients at once, e.g. everyone in a group class
+#JSON payload is {"awards": [{"client_id": ..., "points": ...}, ...]}, returns each client's new total and rank
+@csrf_exempt
+def assign_points_bulk(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method."}, status=405)
+    if not request.user.is_trainer:
+        return JsonResponse({"error": "Only trainers can assign points."}, status=403)
+
+    #Adds up the points per client, a client can appear more than once
+    awards = {}
+    try:
+        for award in json.loads(request.body).get("awards", []):
+            client_id = int(award["client_id"])
+
+            #Points must be a positive whole number, floats and booleans aren't silently converted
+            if isinstance(award["points"], (bool, float)):
+                raise ValueError
+            points = int(award["points"])
+            if points <= 0:
+                raise ValueError
+            awards[client_id] = awards.get(client_id, 0) + points
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({"error": "Each award needs a client_id and a positive whole number of points."}, status=400)
+
+    if not awards:
+        return JsonResponse({"error": "No awards given."}, status=400)
+
+    #Checks every client belongs to the trainer in one query
+    own_clients = set(ClientProfile.objects.filter(id__in=awards, trainer=request.user).values_list("id", flat=True))
+    unknown = sorted(set(awards) - own_clients)
+    if unknown:
+        return JsonResponse({"error": "These clients are not assigned to you.", "client_ids": unknown}, status=400)
+
+    trainer = request.user.trainer_profile
+    season = Season.objects.filter(trainer=trainer, is_active=True).first()
+    if not season:
+        return JsonResponse({"error": "No active season found."}, status=400)
+
+    totals = award_points_bulk(trainer, season, awards)
+    board = get_ranked_leaderboard(season)
+
+    return JsonResponse({
+        "message": "Points assigned successfully.",
+        "results": [
+            {"client_id": client_id, "total_points": total, "rank": board.rank_of(client_id)}
+            for client_id, total in totals.items()
+        ]
+    })
+
 @login_required
 def get_leaderboard(request):
     user = request.user
@@ -878,16 +886,10 @@ def get_leaderboard(request):
     if not season:
         return JsonResponse({"error": "No active season."}, status=404)
 
-    #Retrieves all leaderboard (entry) objects for the season
-    entries = Leaderboard.objects.filter(trainer=trainer, season=season).order_by('-points')
-
-    #Fetches username + points, for each user to show leaderboard on frontend
-    data = [
-        {
-            "client_username": entry.client.user.username,
-            "points": entry.points
-        } for entry in entries
-    ]
+    #Ranked entries for the season from the cached leaderboard, limit= returns only the top entries
+    board = get_ranked_leaderboard(season)
+    limit = request.GET.get("limit")
+    data = board.top(int(limit) if limit and limit.isdigit() else None)
 
     rewards = {
         "first": season.first_place_reward,
@@ -895,7 +897,14 @@ def get_leaderboard(request):
         "third": season.third_place_reward
     }
 
-    return JsonResponse({"leaderboard": data, "season": season.name, "rewards": rewards, "end_date": season.end_date.isoformat()})
+    response = {"leaderboard": data, "season": season.name, "rewards": rewards, "end_date": season.end_date.isoformat()}
+
+    #Clients also get their own rank, even when outside the requested top entries
+    if user.is_client:
+        response["my_rank"] = board.rank_of(user.client_profile.id)
+        response["my_points"] = board.points_of(user.client_profile.id)
+
+    return JsonResponse(response)
 
 
 
@@ -911,12 +920,9 @@ def get_client_points(request, client_id):
     if not season:
         return JsonResponse({"error": "No active season"}, status=404)
 
-    try:
-        #Gets leaderboard entry for the desired client so their points can be accessed
-        entry = Leaderboard.objects.get(client_id=client_id, trainer=trainer, season=season)
-        return JsonResponse({"points": entry.points})
-    except Leaderboard.DoesNotExist:
-        return JsonResponse({"points": 0})  
+    #Reads the client's points and rank from the cached leaderboard
+    board = get_ranked_leaderboard(season)
+    return JsonResponse({"points": board.points_of(client_id), "rank": board.rank_of(client_id)})  
 
 @csrf_exempt
 @login_required
@@ -997,26 +1003,9 @@ def save_recommended_workout(request, plan_id):
 def get_saved_recommended_workouts(request):
     try:
         client = request.user.client_profile
-        saved = SavedWorkout.objects.filter(client=client).select_related('workout_plan')
-        data = []
-
-        #iterates through client's saved workouts and returns to frontend 
-        for item in saved:
-            plan = item.workout_plan
-            top_rating = plan.ratings.order_by('-rating').first()
-            days = WorkoutPlanDay.objects.filter(workout_plan=plan).order_by("day_number")
-            exercises = {
-                f"Day {day.day_number}": day.exercises for day in days
-            }
 
-            data.append({
-                "plan_id": plan.id,
-                "training_frequency": plan.training_frequency,
-                "created_at": plan.created_at.strftime('%Y-%m-%d'),
-                "workout_name": top_rating.workout_name if top_rating else "Unnamed Plan",
-                "rated_by": top_rating.client.user.username if top_rating else "Unknown",
-                "workout_plan": exercises
-            })
+        #Serialises client's saved workouts and returns to frontend 
+        data = [serialize_plan_with_days(plan) for plan in saved_plans_for(client)]
 
         return JsonResponse({"saved_workouts": data}, status=200)
     except Exception as e:
@@ -1051,27 +1040,9 @@ def get_client_saved_workouts(request, client_id):
         
         #Gets the corresponding ClientProfile object based on ID, and then their saved workouts based on that
         client = get_object_or_404(ClientProfile, id=client_id)
-        saved = SavedWorkout.objects.filter(client=client).select_related('workout_plan')
-
-        #Stores the saved workouts and iterates through them
-        data = []
-        for item in saved:
-            plan = item.workout_plan
-            top_rating = plan.ratings.order_by('-rating').first()
-            days = WorkoutPlanDay.objects.filter(workout_plan=plan).order_by("day_number")
-            exercises = {
-                f"Day {day.day_number}": day.exercises for day in days
-            }
 
-            #Serialises the plan data to be returned to the frontend
-            data.append({
-                "plan_id": plan.id,
-                "training_frequency": plan.training_frequency,
-                "created_at": plan.created_at.strftime('%Y-%m-%d'),
-                "workout_name": top_rating.workout_name if top_rating else "Unnamed Plan",
-                "rated_by": top_rating.client.user.username if top_rating else "Unknown",
-                "workout_plan": exercises
-            })
+        #Serialises the saved workouts to be returned to the frontend
+        data = [serialize_plan_with_days(plan) for plan in saved_plans_for(client)]
 
         return JsonResponse({"saved_workouts": data}, status=200)
 
@@ -1085,20 +1056,9 @@ def assign_saved_workout(request, client_id, plan_id):
         client = get_object_or_404(ClientProfile, id=client_id)
         source_plan = get_object_or_404(WorkoutPlan, id=plan_id)
 
-        #Creates a copy of the desired workout plan to assign
-        new_plan = WorkoutPlan.objects.create(
-            client=client,
-            training_frequency=source_plan.training_frequency
-        )
-
-        #Copies all workout plan days and assigns them to the workout plan
-        source_days = WorkoutPlanDay.objects.filter(workout_plan=source_plan)
-        for day in source_days:
-            WorkoutPlanDay.objects.create(
-                workout_plan=new_plan,
-                day_number=day.day_number,
-                exercises=day.exercises
-            )
+        #Creates a copy of the desired workout plan and all of its days to assign
+        source_days = WorkoutPlanDay.objects.filter(workout_plan=source_plan).values_list("day_number", "exercises")
+        create_workout_plan(client, source_days, training_frequency=source_plan.training_frequency)
 
         return JsonResponse({"message": "Workout plan set as active."}, status=200)
 
@@ -0,0 +1,28 @@
+//Polling for plan generation jobs queued by the generate-meal-plan and generate-workout-plan endpoints
+
+//How often the job is checked, and how long to wait before giving up
+const POLL_INTERVAL_MS = 500;
+const TIMEOUT_MS = 60000;
+
+//Polls a plan generation job until a worker has finished it, returns the job's result
+//Throws an error with a message that can be shown to the user if the job fails or takes too long
+export async function waitForJob(job, { interval = POLL_INTERVAL_MS, timeout = TIMEOUT_MS } = {}) {
+  const deadline = Date.now() + timeout;
+  while (job.status === "queued" || job.status === "running") {
+    if (Date.now() > deadline) {
+      throw new Error("Plan generation is taking longer than expected. Please try again later.");
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval));
+    const response = await fetch(`http://127.0.0.1:8000/plan-jobs/${job.job_id}/`, {
+      credentials: "include"
+    });
+    if (!response.ok) {
+      throw new Error("Could not check on plan generation.");
+    }
+    job = await response.json();
+  }
+  if (job.status !== "done") {
+    throw new Error(job.error || "Plan generation failed.");
+  }
+  return job.result;
+}